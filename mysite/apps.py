@@ -6,4 +6,4 @@ class AppConfig(BaseAppConfig):
     name = "mysite"
 
     def ready(self):
-        pass
+        from . import hooks  # noqa: F401
@@ -1,3 +1,6 @@
+from functools import lru_cache
+from types import MappingProxyType
+
 try:
     from . import site_config
 except ImportError:
@@ -9,9 +12,14 @@ def get_site_config(key, default):
     return getattr(site_config, key, default)
 
 
-def site_settings(request):
-    """Make site configuration available to all templates."""
-    return {
+@lru_cache(maxsize=None)
+def site_settings_snapshot():
+    """The template settings, read from site_config once per process.
+
+    site_config is a Python module, so it can't change without a restart.
+    """
+    contact_email = get_site_config('CONTACT_EMAIL', '')
+    return MappingProxyType({
         'SITE_TITLE': get_site_config('SITE_TITLE', 'Memorial Page'),
         'SITE_SUBTITLE': get_site_config('SITE_SUBTITLE', 'In Loving Memory'),
         'SITE_DESCRIPTION': get_site_config('SITE_DESCRIPTION', ''),
@@ -21,10 +29,15 @@ def site_settings(request):
         'REQUIRE_APPROVAL': get_site_config('REQUIRE_APPROVAL', False),
         'BACKGROUND_IMAGE': get_site_config('BACKGROUND_IMAGE', ''),
         'THEME': get_site_config('THEME', 'default'),
-        'CONTACT_EMAIL_USER': get_site_config('CONTACT_EMAIL', '').split('@')[0] if get_site_config('CONTACT_EMAIL', '') else '',
-        'CONTACT_EMAIL_DOMAIN': get_site_config('CONTACT_EMAIL', '').split('@')[1] if '@' in get_site_config('CONTACT_EMAIL', '') else '',
+        'CONTACT_EMAIL_USER': contact_email.split('@')[0] if contact_email else '',
+        'CONTACT_EMAIL_DOMAIN': contact_email.split('@')[1] if '@' in contact_email else '',
         'FOOTER_TEXT': get_site_config('FOOTER_TEXT', ''),
         'CONTACT_PROMPT': get_site_config('CONTACT_PROMPT', 'Questions?'),
         'DONATION_TEXT': get_site_config('DONATION_TEXT', ''),
         'PASSWORD_HINT': get_site_config('PASSWORD_HINT', ''),
-    }
+    })
+
+
+def site_settings(request):
+    """Make site configuration available to all templates."""
+    return site_settings_snapshot()
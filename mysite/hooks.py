@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def sqlite_pragmas():
+    """PRAGMAs for the production SQLite profile (settings.SQLITE_PRODUCTION)."""
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=%d" % settings.SQLITE_BUSY_TIMEOUT,
+        "PRAGMA mmap_size=%d" % settings.SQLITE_MMAP_SIZE,
+        "PRAGMA cache_size=%d" % settings.SQLITE_CACHE_SIZE,
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+def apply_sqlite_pragmas(cursor):
+    for pragma in sqlite_pragmas():
+        cursor.execute(pragma)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == "sqlite" and settings.SQLITE_PRODUCTION:
+        with connection.cursor() as cursor:
+            apply_sqlite_pragmas(cursor)
@@ -0,0 +1,131 @@
+"""Serving uploaded files from MEDIA_ROOT, in production too.
+
+With MEDIA_SENDFILE set, Django only checks the path and answers
+conditional requests; the front-end server sends the bytes itself
+(``X-Accel-Redirect`` for nginx, ``X-Sendfile`` for Apache/lighttpd).
+Otherwise the file is streamed from here with a strong ETag, 304s and
+single byte ranges.
+
+Browsers revalidate files daily. Nothing is marked immutable: resized
+copies keep their names when they are rebuilt (``build_derivatives --all``).
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
+
+CACHE_CONTROL = 'public, max-age=86400'
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK = 64 * 1024
+
+
+def parse_range(header, size):
+    """``(start, end)`` inclusive for a single-range header, None to send it all.
+
+    Raises ValueError when the range can't be satisfied.
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    if not match:
+        return None  # several ranges, or not bytes: a full response is allowed
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = int(last)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def stream(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(STREAM_CHUNK, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def media_path(path):
+    """Full path and ``os.stat()`` of the file at ``path`` in MEDIA_ROOT; 404 if there's none."""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+    return full_path, stat
+
+
+def sendfile_response(path, full_path, content_type):
+    """An empty response telling the front-end server which file to send."""
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_SENDFILE == 'nginx':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+
+def range_response(request, full_path, size, etag, content_type):
+    """The file, or the single range of it the request asks for."""
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # A stale If-Range means the client's partial copy is outdated: send it all
+    if not range_header or (if_range and etag not in parse_etags(if_range)):
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    if not byte_range:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+    start, end = byte_range
+    response = StreamingHttpResponse(stream(full_path, start, end - start + 1),
+                                     status=206, content_type=content_type)
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    return response
+
+
+def serve(request, path):
+    full_path, stat = media_path(path)
+    etag = quote_etag('%x-%x' % (stat.st_mtime_ns, stat.st_size))
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = content_type or 'application/octet-stream'
+        if getattr(settings, 'MEDIA_SENDFILE', None):
+            response = sendfile_response(path, full_path, content_type)
+        else:
+            response = range_response(request, full_path, stat.st_size, etag, content_type)
+            if response.status_code == 416:
+                return response
+            if encoding:
+                response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
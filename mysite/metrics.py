@@ -0,0 +1,171 @@
+"""Request metrics in the Prometheus text format, summed over all workers.
+
+Each process keeps its counters in memory and, with METRICS_DIR set, writes
+them to its own JSON file there at most every METRICS_FLUSH_SECONDS. The
+metrics view adds up every file, so whichever gunicorn worker answers the
+scrape reports the whole server. Files of workers that have exited are kept
+so the totals never go backwards; clear the directory when restarting the
+service if it grows.
+
+The view is disabled (404) unless METRICS_TOKEN is set, and then needs
+``Authorization: Bearer <METRICS_TOKEN>``.
+"""
+import copy
+import glob
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+
+# Upper bounds, in seconds, of the request duration histogram's buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def empty_view_metrics():
+    return {
+        'buckets': [0] * (len(BUCKETS) + 1),  # the last one is +Inf
+        'sum': 0.0,
+        'responses': {},
+        'db_queries': 0,
+        'db_seconds': 0.0,
+        'spans': {},
+    }
+
+
+class Registry:
+    """This process's metrics: ``{view name: empty_view_metrics()}``."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.started = int(time.time() * 1000)
+        self.views = {}
+        self.flushed_at = 0.0
+
+    def observe(self, view, status, seconds, timer):
+        with self.lock:
+            if os.getpid() != self.pid:
+                self.reset()  # forked from a process that had already counted
+            data = self.views.setdefault(view, empty_view_metrics())
+            bucket = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+            data['buckets'][bucket] += 1
+            data['sum'] += seconds
+            status_class = '%dxx' % (status // 100)
+            data['responses'][status_class] = data['responses'].get(status_class, 0) + 1
+            data['db_queries'] += timer.queries
+            data['db_seconds'] += timer.db_seconds
+            for name, span_seconds in timer.spans.items():
+                data['spans'][name] = data['spans'].get(name, 0.0) + span_seconds
+        self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return copy.deepcopy(self.views)
+
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, 'worker-%d-%d.json' % (self.pid, self.started))
+
+    def flush(self, force=False):
+        """Write this process's file if METRICS_DIR is set and it's due."""
+        if not settings.METRICS_DIR:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed_at < settings.METRICS_FLUSH_SECONDS:
+            return
+        self.flushed_at = now
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = self.path()
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    """Add up several processes' ``{view: metrics}``."""
+    total = {}
+    for views in snapshots:
+        for view, data in views.items():
+            merged = total.setdefault(view, empty_view_metrics())
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], data['buckets'])]
+            merged['sum'] += data['sum']
+            merged['db_queries'] += data['db_queries']
+            merged['db_seconds'] += data['db_seconds']
+            for key in ('responses', 'spans'):
+                for name, value in data[key].items():
+                    merged[key][name] = merged[key].get(name, 0) + value
+    return total
+
+
+def collect():
+    """Metrics of every worker (or just this process, without METRICS_DIR)."""
+    if not settings.METRICS_DIR:
+        return registry.snapshot()
+    registry.flush(force=True)
+    snapshots = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, 'worker-*.json')):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # replaced while we read it
+    return merge(snapshots)
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(views):
+    lines = [
+        '# HELP memorial_request_duration_seconds Time taken to produce a response.',
+        '# TYPE memorial_request_duration_seconds histogram',
+    ]
+    for view, data in sorted(views.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), data['buckets']):
+            cumulative += count
+            lines.append('memorial_request_duration_seconds_bucket{view="%s",le="%s"} %d' % (
+                label(view), bound, cumulative))
+        lines.append('memorial_request_duration_seconds_sum{view="%s"} %.6f' % (label(view), data['sum']))
+        lines.append('memorial_request_duration_seconds_count{view="%s"} %d' % (label(view), cumulative))
+
+    lines += ['# HELP memorial_responses_total Responses by status class.',
+              '# TYPE memorial_responses_total counter']
+    for view, data in sorted(views.items()):
+        for status, count in sorted(data['responses'].items()):
+            lines.append('memorial_responses_total{view="%s",status="%s"} %d' % (label(view), status, count))
+
+    lines += ['# HELP memorial_db_queries_total Database queries run by requests.',
+              '# TYPE memorial_db_queries_total counter']
+    lines += ['memorial_db_queries_total{view="%s"} %d' % (label(view), data['db_queries'])
+              for view, data in sorted(views.items())]
+    lines += ['# HELP memorial_db_seconds_total Time requests spent in database queries.',
+              '# TYPE memorial_db_seconds_total counter']
+    lines += ['memorial_db_seconds_total{view="%s"} %.6f' % (label(view), data['db_seconds'])
+              for view, data in sorted(views.items())]
+
+    lines += ['# HELP memorial_span_seconds_total Time requests spent rendering templates, '
+              'compressing images, looking up embeds and sending mail.',
+              '# TYPE memorial_span_seconds_total counter']
+    for view, data in sorted(views.items()):
+        for span, seconds in sorted(data['spans'].items()):
+            lines.append('memorial_span_seconds_total{view="%s",span="%s"} %.6f' % (
+                label(view), label(span), seconds))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token or not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+        raise Http404('Not found')
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
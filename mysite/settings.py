@@ -14,15 +14,43 @@ ALLOWED_HOSTS = getattr(site_config, 'ALLOWED_HOSTS', ['127.0.0.1', 'localhost']
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": "dev.db",
+        "NAME": getattr(site_config, 'DATABASE_PATH', "dev.db"),
     }
 }
 
+# Production SQLite profile: WAL journal, relaxed fsync, a busy timeout and
+# persistent connections, so concurrent uploads don't hit "database is
+# locked". The PRAGMAs are applied per connection in mysite/hooks.py.
+SQLITE_PRODUCTION = getattr(site_config, 'SQLITE_PRODUCTION', False)
+SQLITE_BUSY_TIMEOUT = getattr(site_config, 'SQLITE_BUSY_TIMEOUT', 5000)  # milliseconds
+SQLITE_MMAP_SIZE = getattr(site_config, 'SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+SQLITE_CACHE_SIZE = getattr(site_config, 'SQLITE_CACHE_SIZE', -20000)  # negative = KiB
+if SQLITE_PRODUCTION:
+    DATABASES["default"]["CONN_MAX_AGE"] = getattr(site_config, 'CONN_MAX_AGE', 600)
+
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 PACKAGE_ROOT = os.path.abspath(os.path.dirname(__file__))
 BASE_DIR = PACKAGE_ROOT
 
+# File-based so every gunicorn worker shares it (no Redis/memcached needed)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": getattr(site_config, 'CACHE_DIR', os.path.join(PROJECT_ROOT, "cache")),
+        "OPTIONS": {
+            "MAX_ENTRIES": 5000,
+        },
+    }
+}
+
+# Cached feed pages are invalidated explicitly (see submissions.feedcache);
+# the timeout only bounds how long unused entries linger.
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+# How long a shared cache (reverse proxy, CDN) may serve a feed page without
+# asking again; browsers always revalidate, which costs one small query.
+FEED_SHARED_MAX_AGE = getattr(site_config, 'FEED_SHARED_MAX_AGE', 60)
+
 
 
 
@@ -75,6 +103,12 @@ MEDIA_ROOT = os.path.join(PACKAGE_ROOT, "site_media", "media")
 # Examples: "http://media.lawrence.com/media/", "http://example.com/media/"
 MEDIA_URL = "/site_media/media/"
 
+# Media is served by mysite.media.serve. Set MEDIA_SENDFILE to "nginx"
+# (X-Accel-Redirect to an internal location at MEDIA_ACCEL_PREFIX) or
+# "sendfile" (X-Sendfile, Apache/lighttpd) to let the web server send the bytes.
+MEDIA_SENDFILE = getattr(site_config, 'MEDIA_SENDFILE', None)
+MEDIA_ACCEL_PREFIX = getattr(site_config, 'MEDIA_ACCEL_PREFIX', "/protected-media/")
+
 # Absolute path to the directory static files should be collected to.
 # Don"t put anything in this directory yourself; store your static files
 # in apps" "static/" subdirectories and in STATICFILES_DIRS.
@@ -100,7 +134,7 @@ STATICFILES_FINDERS = [
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "mysite.timing.TimedDjangoTemplates",
         "DIRS": [
             os.path.join(PACKAGE_ROOT, "templates"),
         ],
@@ -123,6 +157,7 @@ TEMPLATES = [
 ]
 
 MIDDLEWARE = [
+    "mysite.timing.TimingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -175,7 +210,11 @@ LOGGING = {
             "level": "ERROR",
             "filters": ["require_debug_false"],
             "class": "django.utils.log.AdminEmailHandler"
-        }
+        },
+        "console": {
+            "level": "WARNING",
+            "class": "logging.StreamHandler",
+        },
     },
     "loggers": {
         "django.request": {
@@ -183,6 +222,12 @@ LOGGING = {
             "level": "ERROR",
             "propagate": True,
         },
+        # Requests slower than SLOW_REQUEST_MS, with their slowest queries
+        "mysite.timing": {
+            "handlers": ["console"],
+            "level": "WARNING",
+            "propagate": False,
+        },
     }
 }
 
@@ -208,3 +253,40 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Password to access submission form (set in site_config.py or via environment variable)
 SUBMISSION_PASSWORD = os.environ.get("SUBMISSION_PASSWORD") or getattr(site_config, 'SUBMISSION_PASSWORD', 'changeme')
+
+# Process uploads inside the request instead of queueing them for
+# `manage.py runjobs` (handy for development; blocks a worker per photo)
+JOBS_RUN_INLINE = getattr(site_config, 'JOBS_RUN_INLINE', False)
+
+# oEmbed (YouTube, Vimeo, ...) lookups are cached per URL. Failed lookups are
+# retried after EMBED_NEGATIVE_TTL. EMBED_TRANSPORT is an optional dotted path
+# to a callable(endpoint_url) -> response body, replacing the HTTP fetch.
+EMBED_CACHE_TTL = 60 * 60 * 24 * 30
+EMBED_NEGATIVE_TTL = 60 * 60
+EMBED_TRANSPORT = None
+
+# Photos are uploaded in chunks to this directory, then moved into
+# MEDIA_ROOT; `manage.py purge_uploads` removes partial uploads abandoned for
+# CHUNKED_UPLOAD_MAX_AGE seconds
+CHUNKED_UPLOAD_DIR = getattr(site_config, 'CHUNKED_UPLOAD_DIR', os.path.join(PROJECT_ROOT, "uploads-partial"))
+CHUNKED_UPLOAD_MAX_AGE = 60 * 60 * 24
+
+# `manage.py purge_drafts` deletes never-sent drafts untouched for this long
+DRAFT_MAX_AGE = 60 * 60 * 24 * getattr(site_config, 'DRAFT_MAX_AGE_DAYS', 30)
+
+# `manage.py purge_jobs` deletes finished background jobs older than this
+JOB_MAX_AGE = 60 * 60 * 24 * getattr(site_config, 'JOB_MAX_AGE_DAYS', 14)
+
+# markdown2 options for submission text. Changing them requires
+# `manage.py render_markdown` to refresh already-rendered submissions.
+MARKDOWN_EXTRAS = {}
+MARKDOWN_SAFE_MODE = False
+
+# Every response carries a Server-Timing header (see mysite.timing); slower
+# requests are logged with their worst SQL. Per-view metrics are served at
+# /metrics/ in the Prometheus format when METRICS_TOKEN is set; METRICS_DIR
+# is where each gunicorn worker leaves its numbers for the others to add up.
+SLOW_REQUEST_MS = getattr(site_config, 'SLOW_REQUEST_MS', 1000)
+METRICS_TOKEN = getattr(site_config, 'METRICS_TOKEN', None)
+METRICS_DIR = getattr(site_config, 'METRICS_DIR', None)
+METRICS_FLUSH_SECONDS = 5
@@ -53,3 +53,42 @@ FOOTER_TEXT = "Photo uploads and texts by their respective authors."
 # NOTIFICATION_EMAIL = "you@example.com"
 # NOTIFICATION_FROM = "memorial@example.com"
 # SENDMAIL_COMMAND = "/usr/sbin/sendmail"  # or path to custom sendmail wrapper
+# Collect submissions for this many minutes and send one email about all of them
+# NOTIFICATION_DIGEST_MINUTES = 60
+
+# Uploaded photos are compressed in the background by `./manage.py runjobs`.
+# Set to True to process them during the upload request instead (no worker needed).
+# JOBS_RUN_INLINE = False
+
+# Directory for the page cache shared by all server processes
+# CACHE_DIR = "/var/cache/memorial-page"
+
+# Database file (relative to where the server is started, or absolute)
+# DATABASE_PATH = "/var/lib/memorial-page/memorial.db"
+
+# Recommended for production: WAL mode, busy timeout and persistent
+# connections for SQLite, so busy days don't cause "database is locked"
+# SQLITE_PRODUCTION = True
+# SQLITE_BUSY_TIMEOUT = 5000  # milliseconds to wait for a lock
+
+# Days before `manage.py purge_drafts` removes drafts that were never sent
+# DRAFT_MAX_AGE_DAYS = 30
+
+# Days `manage.py purge_jobs` keeps finished background jobs (failed ones
+# hold the error, for looking into)
+# JOB_MAX_AGE_DAYS = 14
+
+# Directory for partially uploaded photos (not served to the web)
+# CHUNKED_UPLOAD_DIR = "/var/lib/memorial-page/uploads-partial"
+
+# Let the web server send uploaded photos (see README, Production Deployment):
+# "nginx" for X-Accel-Redirect, or "sendfile" for Apache/lighttpd X-Sendfile
+# MEDIA_SENDFILE = "nginx"
+# MEDIA_ACCEL_PREFIX = "/protected-media/"
+
+# Log requests slower than this many milliseconds, with their slowest queries
+# SLOW_REQUEST_MS = 1000
+# Serve per-page metrics for Prometheus at /metrics/ (send the token as
+# "Authorization: Bearer ..."); the directory collects every worker's numbers
+# METRICS_TOKEN = "a-long-random-string"
+# METRICS_DIR = "/var/lib/memorial-page/metrics"
@@ -0,0 +1,133 @@
+"""Where each request's time goes.
+
+TimingMiddleware measures every request: total time, database queries
+(count, time and the slowest few), template rendering, and the spans marked
+with ``timed()`` (image compression, oEmbed lookups, sendmail). The result
+goes out in a ``Server-Timing`` header, which browser dev tools show under
+the request's Timing tab, and into ``mysite.metrics``. Requests slower than
+SLOW_REQUEST_MS are logged with their worst SQL.
+"""
+import heapq
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+WORST_QUERIES = 3
+MAX_SQL_LENGTH = 500
+
+_current = ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+    """Measurements for one request; also a database execute wrapper."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest = []  # min-heap of (seconds, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += elapsed
+            entry = (elapsed, sql[:MAX_SQL_LENGTH])
+            if len(self.slowest) < WORST_QUERIES:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self, total):
+        metrics = ['total;dur=%.1f' % (total * 1000),
+                   'db;dur=%.1f;desc="%d queries"' % (self.db_seconds * 1000, self.queries)]
+        metrics += ['%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in sorted(self.spans.items())]
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent inside to the current request's ``name`` span.
+
+    Works as a decorator too. Outside a request (e.g. in ``runjobs``) it
+    does nothing.
+    """
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+class TimingMiddleware:
+    """Goes first in MIDDLEWARE, so the total includes the other middleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = RequestTimer()
+        token = _current.set(timer)
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = timer.elapsed()
+        response['Server-Timing'] = timer.server_timing(total)
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unmatched>'
+        metrics.registry.observe(view, response.status_code, total, timer)
+        if total * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request: %s %s took %.0f ms (%s), %d queries in %.0f ms. Slowest:\n%s",
+                request.method, request.get_full_path(), total * 1000, view, timer.queries,
+                timer.db_seconds * 1000,
+                '\n'.join('  %.1f ms: %s' % (seconds * 1000, sql)
+                          for seconds, sql in sorted(timer.slowest, reverse=True)) or '  (none)')
+        return response
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, adding render time to the ``template`` span."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
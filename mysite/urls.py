@@ -1,13 +1,20 @@
+import re
+
 from django.conf import settings
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, include, re_path
 
 from django.contrib import admin
 
+from .media import serve
+from .metrics import metrics_view
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", metrics_view, name='metrics'),
     path("", include("submissions.urls")),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Unlike django.conf.urls.static, this also works with DEBUG = False
+if not settings.MEDIA_URL.startswith(('http://', 'https://', '//')):
+    urlpatterns.append(re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve, name='media'))
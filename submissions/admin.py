@@ -1,9 +1,11 @@
 from django.contrib import admin
 from .models import Submission, Image, Link
 from django.core.exceptions import PermissionDenied
-from django_object_actions import DjangoObjectActions
+from django.db.models import Count, IntegerField, JSONField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.html import format_html
+from django_object_actions import DjangoObjectActions, action
 from django.contrib.admin import SimpleListFilter
-from django.utils import timezone
 
 class ModerationFilter(SimpleListFilter):
     title = 'Accepted'
@@ -22,31 +24,90 @@ class ModerationFilter(SimpleListFilter):
 
 class ImageInlineAdmin(admin.TabularInline):
     model = Image
+    # Files and blobs change only through the upload path, which keeps blob
+    # refcounts in step; the processing fields are written by the job.
+    fields = ('file', 'order', 'status', 'blob')
+    readonly_fields = ('file', 'status', 'blob')
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('blob')
+
+
 class LinkInlineAdmin(admin.TabularInline):
     model = Link
 
+
+def count_of(model):
+    """Correlated COUNT of ``model`` rows per submission (no join fan-out)."""
+    return Coalesce(Subquery(
+        model.objects.filter(submission=OuterRef('pk')).order_by()
+        .values('submission').annotate(n=Count('pk')).values('n'),
+        output_field=IntegerField()), 0)
+
+
 class SubmissionAdmin(DjangoObjectActions, admin.ModelAdmin):
     inlines = [ImageInlineAdmin,LinkInlineAdmin]
 
-    actions = ['approve']
+    actions = ['approve', 'unapprove']
+    list_display = ('__str__', 'thumbnail', 'image_count', 'link_count',
+                    'submitted_at', 'accepted_at', 'accepted_by')
+    list_select_related = ('accepted_by',)
     list_filter = ('accepted_at',ModerationFilter)
+    change_actions = ('approve_obj',)
 
-    def approve(self, request, queryset):
-        for x in queryset:
-            self.approve_obj(self, request, x)
+    def get_queryset(self, request):
+        # Counts and the first photo come back with each row, so the
+        # changelist costs the same number of queries however long it is.
+        first_image = Image.objects.filter(submission=OuterRef('pk')).order_by('order', 'id')
+        return super().get_queryset(request).annotate(
+            image_count=count_of(Image),
+            link_count=count_of(Link),
+            first_image_file=Subquery(first_image.values('file')[:1]),
+            first_image_derivatives=Subquery(first_image.values('derivatives')[:1],
+                                             output_field=JSONField()),
+        )
 
-        return None
+    @admin.display(description='Photos', ordering='image_count')
+    def image_count(self, obj):
+        return obj.image_count
 
-    def approve_obj(self, request, obj):
+    @admin.display(description='Links', ordering='link_count')
+    def link_count(self, obj):
+        return obj.link_count
+
+    @admin.display(description='')
+    def thumbnail(self, obj):
+        if not obj.first_image_file:
+            return ''
+        image = Image(file=obj.first_image_file, derivatives=obj.first_image_derivatives or [])
+        return format_html('<img src="{}" alt="" width="80" loading="lazy">', image.thumbnail_url)
+
+    @admin.action(description='Approve selected submissions')
+    def approve(self, request, queryset):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        count = queryset.approve(request.user)
+        self.message_user(request, "Approved %d submission%s." % (count, '' if count == 1 else 's'))
+
+    @admin.action(description='Withdraw approval of selected submissions')
+    def unapprove(self, request, queryset):
         if not self.has_change_permission(request):
             raise PermissionDenied
-        obj.accepted_at=timezone.now()
-        obj.accepted_by=request.user
-        obj.save()
-        self.message_user(request, "Successfully marked submissions as accepted.")
-    approve_obj.label = 'Approve'
+        count = queryset.unapprove()
+        self.message_user(request, "Withdrew approval of %d submission%s." % (count, '' if count == 1 else 's'))
 
-    objectactions = ['approve_obj']
+    @action(label='Approve', description='Show this submission on the memorial page')
+    def approve_obj(self, request, obj):
+        if not self.has_change_permission(request, obj):
+            raise PermissionDenied
+        if Submission.objects.filter(pk=obj.pk).approve(request.user):
+            self.message_user(request, "Successfully marked submission as accepted.")
+        else:
+            self.message_user(request, "Nothing to approve: not yet submitted, or already approved.")
 
 
 
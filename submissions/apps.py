@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class SubmissionsConfig(AppConfig):
+
+    name = "submissions"
+
+    def ready(self):
+        from . import receivers  # noqa: F401
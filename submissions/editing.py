@@ -0,0 +1,105 @@
+"""The submission edit form: story, contact details and links.
+
+Kept apart from ``views`` because it is built on ``extra_views``, which
+only this page needs; ``urls`` imports it on the first request for it.
+"""
+from django import forms
+from django.db import transaction
+from django.forms.models import ModelForm
+from django.forms.utils import ErrorList
+from django.http import HttpResponseRedirect
+from django.utils import timezone
+from extra_views import InlineFormSet
+from extra_views.advanced import UpdateWithInlinesView
+
+from .models import Submission, Link
+from .notifications import queue_notification
+from .views import SubmissionPasswordRequiredMixin
+
+
+class LinkInline(InlineFormSet):
+    model = Link
+    fields = ['link', 'description']
+    extra = 1
+    can_delete = False  # Hide delete checkboxes - empty links are auto-deleted
+
+    def get_queryset(self):
+        # Delete any links with empty link field when loading
+        qs = super().get_queryset()
+        qs.filter(link='').delete()
+        return qs
+
+class SubmissionForm(ModelForm):
+    class Meta:
+        model = Submission
+        widgets={'message': forms.Textarea(attrs={'rows':2, 'cols':15}),
+                 'text': forms.Textarea(attrs={'rows':4, 'cols':15})}
+        fields = ['text','message','name','email',]
+
+    def save(self, commit=True):
+        x = super(SubmissionForm, self).save(commit=False)
+        if 'send' in self.data:
+            x.submitted_at = timezone.now()
+        if commit:
+            x.save()
+        return x
+
+    def clean_name(self):
+        data = self.cleaned_data
+        if 'send' in self.data:
+            if not data.get('name', None):
+                raise forms.ValidationError('Name needed for submission!')
+        return data.get('name', None)
+
+    def clean_text(self):
+        data = self.cleaned_data
+        if 'send' in self.data:
+            if not data.get('text', None) and not self.instance.current_files:
+                raise forms.ValidationError('Text or Pictures needed for submission!')
+        return data.get('text', None)
+
+
+class SubmissionUpdateView(SubmissionPasswordRequiredMixin, UpdateWithInlinesView):
+    model = Submission
+    form_class = SubmissionForm
+    inlines = [LinkInline]
+    success_url = '/'
+
+    def get_queryset(self):
+        base_qs = super(SubmissionUpdateView, self).get_queryset()
+
+        sid = self.request.session.get('submission_id',None)
+        if not sid:
+            sid = Submission.objects.create().pk
+        self.request.session['submission_id'] = sid
+        return base_qs.filter(pk=sid, accepted_at__isnull=True)
+
+    def forms_valid(self, form, inlines):
+        if 'send' in self.request.POST:
+            # SubmissionForm.save() sets submitted_at; the notification email
+            # goes out from the outbox, written in the same transaction
+            with transaction.atomic():
+                self.object = form.save()
+                for formset in inlines:
+                    formset.save()
+                # Validate required fields
+                if not self.object.name:
+                    transaction.set_rollback(True)
+                    error = form._errors.setdefault('name', ErrorList())
+                    error.append('Name is required!')
+                    return self.forms_invalid(form, inlines)
+                if not self.object.text and not self.object.current_files:
+                    transaction.set_rollback(True)
+                    error = form._errors.setdefault('text', ErrorList())
+                    error.append('Please upload images or add text to submit.')
+                    return self.forms_invalid(form, inlines)
+                queue_notification(self.object)
+            # Clear session so user can make another submission
+            if 'submission_id' in self.request.session:
+                del self.request.session['submission_id']
+            return HttpResponseRedirect('/')
+
+        response = super(SubmissionUpdateView, self).forms_valid(form, inlines)
+        # Clean up empty links
+        self.object.link_set.filter(link='').delete()
+        return response
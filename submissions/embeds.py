@@ -0,0 +1,115 @@
+"""oEmbed lookups for links, cached in the database.
+
+``Link.save()`` never waits on the network: it uses whatever ``EmbedCache``
+already knows about the URL and queues a ``resolve_link`` job for the rest.
+Failed lookups are cached too (for a shorter time) so a dead video isn't
+re-fetched on every save.
+"""
+import re
+from datetime import timedelta
+
+import micawber
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from mysite.timing import timed
+
+from .models import EmbedCache
+
+_providers = None
+
+
+def get_providers():
+    """The process-wide provider registry, built on first use."""
+    global _providers
+    if _providers is None:
+        _providers = micawber.bootstrap_basic()
+    return _providers
+
+
+def get_transport():
+    """Callable fetching an oEmbed endpoint URL and returning the body.
+
+    ``None`` means micawber's own urllib fetch. Tests point EMBED_TRANSPORT
+    at a stub so nothing leaves the machine.
+    """
+    path = getattr(settings, 'EMBED_TRANSPORT', None)
+    return import_string(path) if path else None
+
+
+VIDEO_ID_PATTERNS = (
+    ('youtube', re.compile(r'(?:youtu\.be/|[?&]v=|/embed/|/shorts/|/live/)([A-Za-z0-9_-]{11})')),
+    ('vimeo', re.compile(r'vimeo\.com/(?:video/|.*/)?(\d+)')),
+)
+
+
+def is_embeddable(url):
+    return get_providers().provider_for_url(url) is not None
+
+
+def link_fields(url, data):
+    """Link field values for ``url`` given its oEmbed ``data`` (or None)."""
+    if not data:
+        return {'embed': None, 'provider': '', 'video_id': '', 'thumbnail_url': ''}
+    html = data.get('html') or None
+    provider = (data.get('provider_name') or '').lower()
+    video_id = ''
+    for name, pattern in VIDEO_ID_PATTERNS:
+        match = pattern.search(url) or pattern.search(html or '')
+        if match and (not provider or provider == name):
+            provider, video_id = name, match.group(1)
+            break
+    return {
+        'embed': html,
+        'provider': provider[:50],
+        'video_id': video_id,
+        'thumbnail_url': (data.get('thumbnail_url') or '')[:500],
+    }
+
+
+def cached_embed(url):
+    """Return ``(fields, needs_fetch)`` using only the cache.
+
+    ``fields`` are the Link field values from the last known lookup
+    (possibly stale, possibly empty); ``needs_fetch`` says whether a
+    background lookup is worth queueing.
+    """
+    if not is_embeddable(url):
+        return link_fields(url, None), False
+    entry = EmbedCache.objects.filter(url=url).first()
+    if entry is None:
+        return link_fields(url, None), True
+    return link_fields(url, entry.data), entry.expires_at <= timezone.now()
+
+
+def fetch(url, transport=None):
+    """Ask the URL's provider for oEmbed data (network, or ``transport``)."""
+    provider = get_providers().provider_for_url(url)
+    if provider is None:
+        raise micawber.ProviderNotFoundException('Provider not found for "%s"' % url)
+    sep = '&' if '?' in provider.endpoint else '?'
+    endpoint_url = '%s%s%s' % (provider.endpoint.rstrip('&'), sep, provider.encode_params(url))
+    transport = transport or get_transport() or provider.fetch
+    return provider.handle_response(transport(endpoint_url), url)
+
+
+@timed('oembed')
+def resolve(url, transport=None):
+    """Fetch and cache oEmbed data for ``url``; returns the EmbedCache row."""
+    now = timezone.now()
+    try:
+        data = fetch(url, transport)
+    except micawber.ProviderException:
+        # Keep serving a previously good embed through a transient failure
+        previous = EmbedCache.objects.filter(url=url).first()
+        data = previous.data if previous else None
+        ttl = settings.EMBED_NEGATIVE_TTL
+    else:
+        ttl = settings.EMBED_CACHE_TTL
+    entry, _ = EmbedCache.objects.update_or_create(url=url, defaults={
+        'data': data,
+        'fetched_at': now,
+        'expires_at': now + timedelta(seconds=ttl),
+    })
+    return entry
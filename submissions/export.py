@@ -0,0 +1,222 @@
+"""Export the public feed as a static site, incrementally.
+
+Pages are cut from the oldest submission forwards, so sending a new
+submission only changes the newest page and the front page; older pages
+keep their content and their URL (``/page/<n>/``). The front page shows the
+newest page (and the one before it, if the newest isn't full yet) and links
+back through the older ones.
+
+A manifest in the output directory records, per page, a fingerprint of
+what it was rendered from (its submissions' ids and ``updated_at``, the
+templates and the site config) and the SHA-256 of the HTML written. A
+re-run renders only pages whose fingerprint changed and rewrites only
+files whose content did. Media files used by the pages and the static
+assets are copied when new or changed, and media no page uses any more
+is removed.
+
+The output expects to be served at the root of a domain, like the site.
+Links to the submission form still point at ``/submit/``; the search form,
+which needs the live site, is left out.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.finders import get_finders
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+
+from mysite.context_processors import site_settings_snapshot
+
+from .models import Submission
+
+MANIFEST = '.export-manifest.json'
+TEMPLATE = 'submissions/submission_list.html'
+
+
+class ExportPage:
+    """Stand-in for FeedPage: every exported page starts a fresh list."""
+    is_first = True
+
+
+def url_dir(url):
+    """Directory under the output root for a site-relative URL prefix."""
+    return url.strip('/').replace('/', os.sep)
+
+
+def page_path(number):
+    return 'index.html' if number is None else os.path.join('page', str(number), 'index.html')
+
+
+def page_url(number):
+    return '/page/%d/' % number
+
+
+def file_state(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def render_key():
+    """Hash of everything besides the submissions that shapes a page."""
+    digest = hashlib.sha256()
+    template_dirs = list(settings.TEMPLATES[0]['DIRS'])
+    template_dirs.append(os.path.join(os.path.dirname(__file__), 'templates'))
+    for template_dir in template_dirs:
+        for root, dirs, files in os.walk(template_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(path.encode('utf-8'))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    digest.update(json.dumps(dict(site_settings_snapshot()), sort_keys=True, default=str).encode('utf-8'))
+    digest.update(('%s|%s' % (settings.STATIC_URL, settings.MEDIA_URL)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class StaticExport:
+
+    def __init__(self, output, page_size=10, force=False):
+        self.output = output
+        self.page_size = page_size
+        self.force = force
+        self.stats = {'rendered': 0, 'written': 0, 'unchanged': 0, 'removed': 0,
+                      'media': 0, 'static': 0}
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.output, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        if self.force:
+            manifest['pages'] = {}
+        manifest.setdefault('pages', {})
+        manifest.setdefault('media', {})
+        manifest.setdefault('static', {})
+        return manifest
+
+    def save_manifest(self, manifest):
+        self.write(MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+    def write(self, relative_path, content):
+        path = os.path.join(self.output, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+    def pages(self):
+        """``[(number or None for the front page, [(id, updated_at)], older page number)]``."""
+        field = Submission.objects.feed_field()
+        rows = list(Submission.objects.published().order_by(field, 'id').values_list('id', 'updated_at'))
+        chunks = [rows[i:i + self.page_size] for i in range(0, len(rows), self.page_size)] or [[]]
+        front = [len(chunks)]
+        if len(chunks) > 1 and len(chunks[-1]) < self.page_size:
+            front.insert(0, len(chunks) - 1)
+        older = front[0] - 1 or None
+        pages = [(None, [row for n in front for row in chunks[n - 1]], older)]
+        for number in range(front[0] - 1, 0, -1):
+            pages.append((number, chunks[number - 1], number - 1 or None))
+        return pages
+
+    def run(self):
+        manifest = self.load_manifest()
+        key = render_key()
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+
+        pages, media = {}, set()
+        for number, rows, older in self.pages():
+            path = page_path(number)
+            fingerprint = hashlib.sha256(json.dumps(
+                [key, path, older, [(pk, updated.isoformat()) for pk, updated in rows]]).encode('utf-8')).hexdigest()
+            entry = manifest['pages'].get(path)
+            if entry and entry['fingerprint'] == fingerprint and os.path.exists(os.path.join(self.output, path)):
+                pages[path] = entry
+                media.update(entry['media'])
+                continue
+
+            submissions = list(Submission.objects.published().for_feed().filter(id__in=[pk for pk, _ in rows]))
+            html = render_to_string(TEMPLATE, {
+                'object_list': submissions,
+                'feed_page': ExportPage(),
+                'next_page_url': page_url(older) if older else None,
+                'static_export': True,
+            }, request=request).encode('utf-8')
+            self.stats['rendered'] += 1
+            names = sorted({name for submission in submissions
+                            for image in submission.current_files for name in image.file_names})
+            sha256 = hashlib.sha256(html).hexdigest()
+            if entry and entry['sha256'] == sha256 and os.path.exists(os.path.join(self.output, path)):
+                self.stats['unchanged'] += 1
+            else:
+                self.write(path, html)
+                self.stats['written'] += 1
+            pages[path] = {'fingerprint': fingerprint, 'sha256': sha256, 'media': names}
+            media.update(names)
+
+        for path in set(manifest['pages']) - set(pages):
+            self.remove(path)
+        manifest['pages'] = pages
+        manifest['media'] = self.sync_media(manifest['media'], media)
+        manifest['static'] = self.sync_static(manifest['static'])
+        self.save_manifest(manifest)
+        return self.stats
+
+    def remove(self, relative_path):
+        path = os.path.join(self.output, relative_path)
+        try:
+            os.unlink(path)
+        except OSError:
+            return
+        self.stats['removed'] += 1
+        try:
+            os.removedirs(os.path.dirname(path))  # only the directories left empty
+        except OSError:
+            pass
+
+    def copy(self, source, relative_path, known):
+        """Copy ``source`` unless the copy made last time is still current."""
+        state = file_state(source)
+        target = os.path.join(self.output, relative_path)
+        if known.get(relative_path) == state and os.path.exists(target):
+            return state
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(source, target)
+        return state
+
+    def sync_media(self, known, names):
+        media_dir = url_dir(settings.MEDIA_URL)
+        copied = {}
+        for name in sorted(names):
+            relative_path = os.path.join(media_dir, name)
+            try:
+                state = self.copy(default_storage.path(name), relative_path, known)
+            except OSError:
+                continue  # missing from MEDIA_ROOT; the page shows a broken image there too
+            if state != known.get(relative_path):
+                self.stats['media'] += 1
+            copied[relative_path] = state
+        for relative_path in set(known) - set(copied):
+            self.remove(relative_path)
+        return copied
+
+    def sync_static(self, known):
+        static_dir = url_dir(settings.STATIC_URL)
+        copied = {}
+        for finder in get_finders():
+            for path, storage in finder.list(['admin/*', '.*', '*~']):
+                relative_path = os.path.join(static_dir, path)
+                if relative_path in copied:
+                    continue  # the first finder wins, as with collectstatic
+                state = self.copy(storage.path(path), relative_path, known)
+                if state != known.get(relative_path):
+                    self.stats['static'] += 1
+                copied[relative_path] = state
+        return copied
@@ -0,0 +1,141 @@
+"""Caching for the public feed.
+
+Every cached page is keyed on a global feed version, which the receivers in
+``submissions.receivers`` replace whenever something visible changes. The
+version lives in the shared cache backend, so a bump in one gunicorn worker
+is seen by all of them and nothing waits for a timeout to expire.
+
+The version also starts with the time it was made, which gives the feed
+its Last-Modified: ``conditional_feed_page`` answers revalidation requests
+from browsers and proxies with a 304 before any of this is looked up.
+"""
+import hashlib
+import time
+import uuid
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import Submission
+
+FEED_VERSION_KEY = 'feed:version'
+
+
+def new_feed_version():
+    return '%x-%s' % (int(time.time()), uuid.uuid4().hex)
+
+
+def feed_version():
+    version = cache.get(FEED_VERSION_KEY)
+    if version is None:
+        cache.add(FEED_VERSION_KEY, new_feed_version(), None)
+        version = cache.get(FEED_VERSION_KEY)
+    return version
+
+
+def feed_version_time(version):
+    """When ``version`` was made, or None if it doesn't say."""
+    try:
+        return datetime.fromtimestamp(int(version.split('-')[0], 16), timezone.utc)
+    except (ValueError, OverflowError):
+        return None
+
+
+def bump_feed_version():
+    """Invalidate every cached feed page once the current transaction commits.
+
+    Bumping before the commit would let a request in between cache the old
+    rows under the new version, where they'd stay until the next bump.
+    """
+    transaction.on_commit(lambda: cache.set(FEED_VERSION_KEY, new_feed_version(), None))
+
+
+def feed_stats():
+    """The newest visible submission's time and how many are visible.
+
+    One aggregate over the feed index, remembered for the current feed
+    version: anything that would change it bumps the version.
+    """
+    version = feed_version()
+    key = 'feed:stats:%s' % version
+    stats = cache.get(key)
+    if stats is None:
+        stats = Submission.objects.published().order_by().aggregate(
+            latest=Max(Submission.objects.feed_field()), count=Count('id'))
+        cache.set(key, stats, settings.FEED_CACHE_TIMEOUT)
+    return version, stats
+
+
+def feed_validators(request):
+    """``(etag, last_modified)`` of the feed page at this URL.
+
+    The ETag covers the feed version, the newest visible submission, how
+    many there are and the URL (so the cursor); Last-Modified is the later
+    of that submission and the version, which also moves on edits and
+    deletions.
+    """
+    version, stats = feed_stats()
+    etag = hashlib.md5('|'.join([
+        version, str(stats['latest']), str(stats['count']), request.get_full_path(),
+    ]).encode('utf-8')).hexdigest()
+    moments = [moment for moment in (stats['latest'], feed_version_time(version)) if moment]
+    return '"%s"' % etag, max(moments) if moments else None
+
+
+def cache_feed_page(view_func):
+    """Like ``cache_page``, but keyed on the feed version instead of expiring."""
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+
+        key = 'feed:page:%s:%s' % (
+            feed_version(), hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest())
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = view_func(request, *args, **kwargs)
+        if response.status_code == 200 and not response.cookies:
+            def store(response):
+                cache.set(key, response, settings.FEED_CACHE_TIMEOUT)
+
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+        return response
+    return wrapped
+
+
+def conditional_feed_page(view_func):
+    """Answer If-None-Match/If-Modified-Since for a feed page with 304.
+
+    The validators are checked before the page cache or the view, so a
+    revalidation renders nothing and, once per feed version, runs one
+    aggregate query. Responses may be kept by a shared
+    cache for FEED_SHARED_MAX_AGE seconds; browsers revalidate every time.
+    """
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+
+        etag, last_modified = feed_validators(request)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = view_func(request, *args, **kwargs)
+        if response.status_code in (200, 304) and not response.cookies:
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(timestamp)
+            patch_cache_control(response, public=True, max_age=0, s_maxage=settings.FEED_SHARED_MAX_AGE)
+        return response
+    return wrapped
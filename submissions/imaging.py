@@ -0,0 +1,168 @@
+import base64
+import io
+import math
+import os
+
+from django.core.exceptions import ValidationError
+from PIL import Image as PILImage
+from PIL.ImageOps import exif_transpose
+
+from mysite.timing import timed
+
+
+MAX_DIMENSION = 2000
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+# Widths of the smaller copies written next to each original; the feed picks
+# one through srcset so phones never download the full 2000px file.
+DERIVATIVE_WIDTHS = (480, 960, 1600)
+
+# The feed paints a blurry copy this wide, inlined as a data URI, behind
+# each photo until it has loaded.
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_QUALITY = 40
+
+# Uploads are checked against these from the image header, before anything
+# is decoded. JPEGs are decoded at reduced scale (see compress_image), so
+# they are allowed far more pixels than formats Pillow must decode in full.
+ACCEPTED_FORMATS = ('JPEG', 'MPO', 'PNG', 'GIF', 'WEBP', 'BMP', 'TIFF')
+MAX_PIXELS = 40 * 1000 * 1000
+MAX_JPEG_PIXELS = 120 * 1000 * 1000
+
+
+def check_upload(img):
+    """Reject an opened (not yet decoded) upload by format or pixel count."""
+    if img.format not in ACCEPTED_FORMATS:
+        raise ValidationError('Unsupported image format: %s' % (img.format or 'unknown'))
+    limit = MAX_JPEG_PIXELS if img.format in ('JPEG', 'MPO') else MAX_PIXELS
+    if img.width * img.height > limit:
+        raise ValidationError('Image is too large (%dx%d); the limit is %d megapixels.' % (
+            img.width, img.height, limit // 10 ** 6))
+
+
+def draft_size(size):
+    """Smallest size worth decoding for an image of ``size`` bound for MAX_DIMENSION."""
+    scale = MAX_DIMENSION / max(size)
+    if scale >= 1:
+        return size
+    return tuple(max(1, math.ceil(side * scale)) for side in size)
+
+
+@timed('compress')
+def compress_image(image_path):
+    """Auto-orient, resize if >2000px on any side, and save as JPEG (or PNG if transparent).
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale whenever that still leaves at
+    least MAX_DIMENSION on the long side, so the decoded bitmap is under
+    4000x4000 (about 48 MB) however large the photo. Other formats are
+    decoded in full: at most MAX_PIXELS, about 160 MB with an alpha channel.
+
+    Raises if the file can't be decoded, so the job marks the image failed.
+    """
+    img = PILImage.open(image_path)
+    if img.format in ('JPEG', 'MPO'):
+        img.draft(None, draft_size(img.size))
+
+    # Auto-orient based on EXIF rotation
+    img = exif_transpose(img)
+
+    # Resize if either dimension exceeds MAX_DIMENSION
+    if img.width > MAX_DIMENSION or img.height > MAX_DIMENSION:
+        img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), PILImage.LANCZOS)
+
+    # Keep PNG for images with transparency, convert everything else to JPEG
+    has_transparency = img.mode in ('RGBA', 'LA') or (
+        img.mode == 'P' and 'transparency' in img.info
+    )
+
+    if has_transparency:
+        img.save(image_path, format='PNG', optimize=True)
+    else:
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGB')
+        img.save(image_path, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+
+
+def derivative_name(name, width, fmt):
+    """Name of the ``width``-wide copy of ``name`` in format ``fmt``."""
+    stem, ext = os.path.splitext(name)
+    ext = '.webp' if fmt == 'webp' else ext
+    return '%s_%dw%s' % (stem, width, ext)
+
+
+def build_derivatives(image_path, name):
+    """Write downscaled and WebP copies of a compressed image next to it.
+
+    ``name`` is the storage name of ``image_path``. Returns a list of
+    ``{'name', 'width', 'format'}`` dicts, including the original itself,
+    suitable for ``Image.derivatives``.
+    """
+    derivatives = []
+    with PILImage.open(image_path) as img:
+        img.load()
+        fmt = img.format.lower()
+        derivatives.append({'name': name, 'width': img.width, 'format': fmt})
+
+        widths = [w for w in DERIVATIVE_WIDTHS if w < img.width] + [img.width]
+        for width in widths:
+            if width == img.width:
+                resized = img
+            else:
+                height = max(1, round(img.height * width / img.width))
+                resized = img.resize((width, height), PILImage.LANCZOS)
+
+            for out_fmt in (fmt, 'webp'):
+                if resized is img and out_fmt == fmt:
+                    continue  # that's the original
+                out_name = derivative_name(name, width, out_fmt)
+                out_path = derivative_name(image_path, width, out_fmt)
+                if out_fmt == 'webp':
+                    resized.save(out_path, format='WEBP', quality=WEBP_QUALITY, method=4)
+                elif out_fmt == 'jpeg':
+                    resized.save(out_path, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+                else:
+                    resized.save(out_path, format=img.format, optimize=True)
+                derivatives.append({'name': out_name, 'width': width, 'format': out_fmt})
+    return derivatives
+
+
+def flatten(img):
+    """``img`` as RGB, with any transparency laid over white."""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = PILImage.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+
+def dominant_color(img):
+    """``#rrggbb`` of the most common of a few colours in a small RGB image."""
+    quantized = img.quantize(colors=5)
+    count, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return '#%02x%02x%02x' % (r, g, b)
+
+
+def placeholder_fields(image_path):
+    """Size, dominant colour and a tiny blurry copy of a compressed image.
+
+    Returns ``{'width', 'height', 'color', 'placeholder'}`` for the fields
+    of the same name on ``Image``; ``placeholder`` is a ``data:`` URI of a
+    PLACEHOLDER_WIDTH-wide JPEG (a few hundred bytes).
+    """
+    with PILImage.open(image_path) as img:
+        width, height = img.size
+        if img.format == 'JPEG':
+            img.draft('RGB', (PLACEHOLDER_WIDTH * 8, PLACEHOLDER_WIDTH * 8))
+        small = flatten(img)
+    small.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH), PILImage.LANCZOS)
+    out = io.BytesIO()
+    small.save(out, format='JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    return {
+        'width': width,
+        'height': height,
+        'color': dominant_color(small),
+        'placeholder': 'data:image/jpeg;base64,' + base64.b64encode(out.getvalue()).decode('ascii'),
+    }
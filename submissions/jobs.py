@@ -0,0 +1,110 @@
+"""A small database-backed job queue.
+
+Requests call ``enqueue()`` and return straight away; ``manage.py runjobs``
+claims queued rows and runs them in a process pool. There is no broker: the
+``Job`` table is the queue, and claiming is a single UPDATE so several
+workers can poll the same database without handing out a job twice.
+Finished rows are kept for a while to look into, then ``manage.py
+purge_jobs`` deletes them.
+"""
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+# Task name -> dotted path of a callable taking the job's object_id
+TASKS = {
+    'process_image': 'submissions.tasks.process_image',
+    'resolve_link': 'submissions.tasks.resolve_link',
+    'deliver_notifications': 'submissions.tasks.deliver_notifications',
+}
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30  # seconds, doubled on every failed attempt
+# A job still "running" after this long belonged to a worker that died
+STALE_AFTER = timedelta(minutes=15)
+PURGE_BATCH_SIZE = 500
+
+
+def enqueue(task, object_id, run_after=None):
+    """Queue ``task`` for ``object_id``, or run it now if JOBS_RUN_INLINE is set.
+
+    ``run_after`` holds a queued job back until then; such a job is queued
+    even with JOBS_RUN_INLINE. A task run inline that fails is logged, as
+    the worker would, rather than failing the request that queued it.
+    """
+    if task not in TASKS:
+        raise ValueError('Unknown task: %s' % task)
+    if getattr(settings, 'JOBS_RUN_INLINE', False) and (run_after is None or run_after <= timezone.now()):
+        try:
+            import_string(TASKS[task])(object_id)
+        except Exception:
+            logger.exception("Inline job %s(%s) failed", task, object_id)
+        return None
+    return Job.objects.create(task=task, object_id=object_id, run_after=run_after or timezone.now())
+
+
+def finished_before(cutoff):
+    """Jobs that succeeded or gave up before ``cutoff``."""
+    return Job.objects.filter(state__in=(Job.DONE, Job.FAILED), finished_at__lt=cutoff)
+
+
+def purge_finished(cutoff):
+    """Delete jobs that finished before ``cutoff``; return how many.
+
+    Deletes in batches, so a first run over a long-lived queue doesn't hold
+    the database (which the feed reads too) for one long write.
+    """
+    deleted = 0
+    while True:
+        ids = list(finished_before(cutoff).values_list('pk', flat=True)[:PURGE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        deleted += Job.objects.filter(pk__in=ids).delete()[0]
+
+
+def claim(limit):
+    """Mark up to ``limit`` due jobs as running and return their ids."""
+    now = timezone.now()
+    Job.objects.filter(state=Job.RUNNING, started_at__lt=now - STALE_AFTER).update(
+        state=Job.QUEUED, claimed_by='')
+
+    token = uuid.uuid4().hex
+    due = Job.objects.filter(state=Job.QUEUED, run_after__lte=now).order_by('run_after', 'id')
+    Job.objects.filter(pk__in=due.values('pk')[:limit], state=Job.QUEUED).update(
+        state=Job.RUNNING, claimed_by=token, started_at=now, attempts=F('attempts') + 1)
+    return list(Job.objects.filter(claimed_by=token, state=Job.RUNNING)
+                .order_by('id').values_list('pk', flat=True))
+
+
+def run_job(job_id):
+    """Run a claimed job and record the outcome. Returns the final state."""
+    job = Job.objects.get(pk=job_id)
+    try:
+        import_string(TASKS[job.task])(job.object_id)
+    except Exception:
+        logger.exception("Job %s failed", job)
+        job.error = traceback.format_exc()
+        if job.attempts >= MAX_ATTEMPTS:
+            job.state = Job.FAILED
+            job.finished_at = timezone.now()
+        else:
+            job.state = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(
+                seconds=RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+    else:
+        job.state = Job.DONE
+        job.error = ''
+        job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'error', 'run_after', 'finished_at'])
+    return job.state
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from submissions.embeds import is_embeddable, link_fields, resolve
+from submissions.models import EmbedCache, Link
+
+
+class Command(BaseCommand):
+    help = "Fill in provider, video id and thumbnail for links saved before they were stored."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refetch', action='store_true',
+                            help='Query providers even when a fresh cached response exists.')
+
+    def handle(self, *args, **options):
+        urls = (Link.objects.exclude(embed__isnull=True).exclude(embed='')
+                .filter(provider='').values_list('link', flat=True).distinct())
+        updated = 0
+        for url in urls:
+            if not is_embeddable(url):
+                continue
+            entry = None if options['refetch'] else (
+                EmbedCache.objects.filter(url=url, expires_at__gt=timezone.now()).first())
+            if entry is None:
+                entry = resolve(url)
+            if entry.data is None:
+                self.stderr.write("No oEmbed data for %s" % url)
+                continue
+            updated += Link.objects.filter(link=url).update(**link_fields(url, entry.data))
+        self.stdout.write("Updated %d links." % updated)
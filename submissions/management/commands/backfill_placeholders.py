@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from submissions.imaging import placeholder_fields
+from submissions.models import Image, Submission
+
+
+class Command(BaseCommand):
+    help = "Store size, dominant colour and placeholder for images processed before they were."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Measure every image again, not just ones without a size.')
+
+    def handle(self, *args, **options):
+        images = Image.objects.exclude(file='')
+        if not options['all']:
+            images = images.filter(width__isnull=True)
+
+        updated = 0
+        # Each file once, however many Images share it
+        for name in images.order_by('file').values_list('file', flat=True).distinct():
+            image = Image(file=name)
+            try:
+                fields = placeholder_fields(image.file.path)
+            except Exception as e:
+                self.stderr.write("%s: %s" % (name, e))
+                continue
+            same_file = Image.objects.filter(file=name)
+            updated += same_file.update(**fields)
+            # Re-renders the cached feed cards showing them
+            Submission.objects.filter(pk__in=same_file.values('submission_id')).touch()
+        self.stdout.write("Updated %d images." % updated)
@@ -0,0 +1,74 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Libraries only the upload, edit and link-saving paths need
+HEAVY_MODULES = ('PIL', 'extra_views', 'micawber', 'markdown2')
+
+# Runs in a fresh interpreter: what a gunicorn worker does before its first
+# request, i.e. load the WSGI application and the URL conf.
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import mysite.wsgi
+from django.urls import resolve
+resolve('/')
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+''' % (HEAVY_MODULES,)
+
+
+def probe_startup():
+    """Start a worker-like interpreter once; return its measurements."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='mysite.settings')
+    proc = subprocess.run([sys.executable, '-c', PROBE], cwd=settings.PROJECT_ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise CommandError("Start-up probe failed:\n%s" % proc.stderr)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = ("Measure how long a fresh worker takes to import mysite.wsgi and "
+            "how much memory it holds, as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Number of fresh interpreters to start (default: 5).')
+        parser.add_argument('--max-seconds', type=float,
+                            help='Fail if the median start-up time is above this.')
+        parser.add_argument('--max-rss-mb', type=float,
+                            help='Fail if the peak RSS is above this many MB.')
+
+    def handle(self, *args, **options):
+        runs = [probe_startup() for _ in range(max(1, options['runs']))]
+        seconds = [run['seconds'] for run in runs]
+        result = {
+            'runs': len(runs),
+            'import_seconds': {
+                'median': round(statistics.median(seconds), 4),
+                'min': round(min(seconds), 4),
+                'max': round(max(seconds), 4),
+            },
+            'max_rss_mb': round(max(run['max_rss_kb'] for run in runs) / 1024, 1),
+            'heavy_modules_loaded': runs[0]['loaded'],
+        }
+        self.stdout.write(json.dumps(result, indent=2))
+
+        failures = []
+        if options['max_seconds'] is not None and result['import_seconds']['median'] > options['max_seconds']:
+            failures.append("median start-up %.3fs > %.3fs" % (
+                result['import_seconds']['median'], options['max_seconds']))
+        if options['max_rss_mb'] is not None and result['max_rss_mb'] > options['max_rss_mb']:
+            failures.append("peak RSS %.1f MB > %.1f MB" % (result['max_rss_mb'], options['max_rss_mb']))
+        if failures:
+            raise CommandError("Start-up regression: " + "; ".join(failures))
@@ -0,0 +1,220 @@
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from submissions.management.commands.seed_memorial import make_photo
+from submissions.models import Image, Submission
+from submissions.pagination import encode_cursor
+from submissions.views import SubmissionListView
+
+SCENARIOS = ('home', 'home-cached', 'deep-page', 'feed-more', 'edit-form', 'upload', 'reorder',
+             'admin-changelist')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Time the main pages and actions through the test client against the current "
+            "database and report latency percentiles, query counts and peak RSS as JSON. "
+            "Everything written during the run is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per scenario first.')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, dest='scenarios',
+                            help='Run only this scenario (repeatable; default: all).')
+        parser.add_argument('--depth', type=int, default=20, help='Feed page for deep-page (default: 20).')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--compare', help='Earlier JSON report to compare against.')
+
+    def handle(self, *args, **options):
+        published = Submission.objects.published()
+        if not published.exists():
+            raise CommandError("Nothing to benchmark; run `manage.py seed_memorial` first.")
+        self.options = options
+        self.rng = random.Random(0)
+        # Photos for the draft; copied, since uploads go to a throwaway MEDIA_ROOT
+        self.photos = list(Image.objects.exclude(file='')[:8])
+        self.photo_root = settings.MEDIA_ROOT
+
+        results = {}
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                DEBUG=False, ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=media_root, JOBS_RUN_INLINE=False,
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                    'LOCATION': 'benchmark'}}):
+            with transaction.atomic():
+                self.set_up()
+                for name in options['scenarios'] or SCENARIOS:
+                    prepare, request = getattr(self, 'scenario_' + name.replace('-', '_'))()
+                    results[name] = self.measure(prepare, request)
+                transaction.set_rollback(True)
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'published': published.count(),
+                'images': Image.objects.count(),
+                'iterations': options['iterations'],
+            },
+            'scenarios': results,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), report)
+
+    def set_up(self):
+        """A draft with photos, a session for it, and an admin."""
+        self.draft = Submission.objects.create()
+        for image in self.photos:
+            for name in image.file_names:
+                try:
+                    shutil.copy(os.path.join(self.photo_root, name), os.path.join(settings.MEDIA_ROOT, name))
+                except OSError:
+                    pass
+        Image.objects.bulk_create(
+            Image(submission=self.draft, file=image.file.name, blob_id=image.blob_id,
+                  order=i, **image.processed_fields)
+            for i, image in enumerate(self.photos)
+        )
+        self.client = Client()
+        session = self.client.session
+        session['submission_unlocked'] = True
+        session['submission_id'] = self.draft.pk
+        session.save()
+        self.admin_client = Client()
+        self.admin_client.force_login(User.objects.create_superuser('benchmark-admin', '', None))
+
+    def measure(self, prepare, request):
+        timings, queries, errors = [], [], 0
+        for i in range(self.options['warmup'] + self.options['iterations']):
+            args = prepare()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(*args)
+                elapsed = time.perf_counter() - start
+            if i < self.options['warmup']:
+                continue
+            timings.append(elapsed * 1000)
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+        return {
+            'requests': len(timings),
+            'errors': errors,
+            'mean_ms': round(statistics.mean(timings), 2),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'queries': {'median': statistics.median(queries), 'max': max(queries)},
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def feed_cursor(self, page):
+        """The cursor that starts feed page ``page`` (1 is the first)."""
+        published = Submission.objects.published()
+        field = Submission.objects.feed_field()
+        index = min((page - 1) * SubmissionListView.page_size, published.count()) - 1
+        if index < 0:
+            return None
+        moment, pk = published.values_list(field, 'id')[index]
+        return encode_cursor(moment, pk)
+
+    # Each scenario returns (prepare, request): prepare() runs untimed before
+    # every request and returns the arguments for request().
+
+    def scenario_home(self):
+        return lambda: (cache.clear(),), lambda _: self.client.get('/')
+
+    def scenario_home_cached(self):
+        return lambda: (), lambda: self.client.get('/')
+
+    def scenario_deep_page(self):
+        url = '/?after=%s' % (self.feed_cursor(self.options['depth']) or '')
+        return lambda: (cache.clear(),), lambda _: self.client.get(url)
+
+    def scenario_feed_more(self):
+        url = '%s?after=%s' % (reverse('feed-more'), self.feed_cursor(2) or '')
+        return lambda: (cache.clear(),), lambda _: self.client.get(url)
+
+    def scenario_edit_form(self):
+        url = reverse('submission-edit', kwargs={'pk': self.draft.pk})
+        return lambda: (), lambda: self.client.get(url)
+
+    def scenario_upload(self):
+        url = reverse('jfu-upload', kwargs={'pk': self.draft.pk})
+
+        def prepare():
+            # New content each time, so every upload is stored rather than deduplicated
+            return (SimpleUploadedFile('photo.jpg', make_photo(self.rng), 'image/jpeg'),)
+        return prepare, lambda photo: self.client.post(url, {'file': photo})
+
+    def scenario_reorder(self):
+        url = reverse('reorder-images', kwargs={'pk': self.draft.pk})
+
+        def prepare():
+            ids = list(self.draft.image_set.order_by('order', 'id').values_list('pk', flat=True))
+            return (json.dumps(ids[::-1]),)
+        return prepare, lambda body: self.client.post(url, body, content_type='application/json')
+
+    def scenario_admin_changelist(self):
+        url = reverse('admin:submissions_submission_changelist') + '?accepted=all'
+        return lambda: (), lambda: self.admin_client.get(url)
+
+    def compare(self, before, after):
+        self.stderr.write("%-18s %22s %22s %12s" % ('scenario', 'p50 ms', 'p95 ms', 'queries'))
+        for name, new in after['scenarios'].items():
+            old = before.get('scenarios', {}).get(name)
+            if old is None:
+                continue
+            cells = []
+            for key in ('p50_ms', 'p95_ms'):
+                change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0
+                cells.append('%8.1f -> %-8.1f%+4.0f%%' % (old[key], new[key], change))
+            self.stderr.write("%-18s %22s %22s %5s -> %-4s" % (
+                name, cells[0], cells[1], old['queries']['median'], new['queries']['median']))
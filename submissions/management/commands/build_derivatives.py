@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from submissions.models import Image, Submission
+
+
+class Command(BaseCommand):
+    help = "Write resized and WebP copies for images that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild derivatives for every image, not just missing ones.')
+
+    def handle(self, *args, **options):
+        images = Image.objects.exclude(file='')
+        if not options['all']:
+            images = images.filter(derivatives=[])
+
+        built = 0
+        # Each file once, however many Images share it
+        for name in images.order_by('file').values_list('file', flat=True).distinct():
+            image = Image(file=name)
+            try:
+                image.build_derivatives()
+            except Exception as e:
+                self.stderr.write("%s: %s" % (name, e))
+                continue
+            same_file = Image.objects.filter(file=name)
+            built += same_file.update(**image.processed_fields)
+            # Re-renders the cached feed cards showing them
+            Submission.objects.filter(pk__in=same_file.values('submission_id')).touch()
+        self.stdout.write("Built derivatives for %d images." % built)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from submissions.export import StaticExport
+from submissions.views import SubmissionListView
+
+
+class Command(BaseCommand):
+    help = ("Write the public feed, with its photos and static files, to a directory any "
+            "web server can serve. Re-runs only rewrite what changed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to export to (created if missing).')
+        parser.add_argument('--page-size', type=int, default=SubmissionListView.page_size)
+        parser.add_argument('--force', action='store_true', help='Render every page again.')
+
+    def handle(self, *args, **options):
+        stats = StaticExport(options['output'], options['page_size'], options['force']).run()
+        self.stdout.write(
+            "Rendered %(rendered)d pages: %(written)d written, %(unchanged)d unchanged; "
+            "%(removed)d files removed; copied %(media)d media and %(static)d static files." % stats)
@@ -0,0 +1,86 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from submissions.models import Image, ImageBlob, Submission
+from submissions.utils import human_size
+
+
+class Command(BaseCommand):
+    help = "Delete drafts that were never sent, along with their uploaded images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Only drafts untouched for this many days (default: DRAFT_MAX_AGE).')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting anything.')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            max_age = timedelta(days=options['days'])
+        else:
+            max_age = timedelta(seconds=settings.DRAFT_MAX_AGE)
+        cutoff = timezone.now() - max_age
+        drafts = Submission.objects.abandoned(cutoff).order_by('id')
+
+        deleted = images = reclaimed = 0
+        last_id = 0
+        # Dry run: references to each blob the drafts so far would drop
+        self.dropped = {}
+        while True:
+            # Each batch is its own transaction, so an interrupted run keeps
+            # what it finished and the next run picks up the rest.
+            with transaction.atomic():
+                ids = list(drafts.filter(id__gt=last_id)
+                           .values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                last_id = ids[-1]
+                batch = list(Image.objects.filter(submission_id__in=ids).select_related('blob')
+                             .only('submission_id', 'file', 'derivatives', 'blob__refcount'))
+                if not options['dry_run']:
+                    # Re-check the condition: a draft edited since it was listed is kept
+                    drafts.filter(id__in=ids).delete()
+                    kept = set(Submission.objects.filter(id__in=ids).values_list('id', flat=True))
+                    ids = [pk for pk in ids if pk not in kept]
+                purged = set(ids)
+                batch = [image for image in batch if image.submission_id in purged]
+                deleted += len(ids)
+                images += len(batch)
+                # Measured now: deleting an Image unlinks its files on commit
+                reclaimed += sum(self.size(name) for name in self.removed_files(batch, options['dry_run']))
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write("%s %d drafts with %d images (%s)." % (
+            verb, deleted, images, human_size(reclaimed)))
+
+    def removed_files(self, images, dry_run):
+        """Names of the files that go with ``images``: those no other Image still uses."""
+        if dry_run:
+            for image in images:
+                if image.blob_id:
+                    self.dropped[image.blob_id] = self.dropped.get(image.blob_id, 0) + 1
+            released = {image.blob_id for image in images
+                        if image.blob_id and self.dropped[image.blob_id] >= image.blob.refcount}
+        else:
+            # release() deletes a blob when its last reference goes
+            blob_ids = {image.blob_id for image in images if image.blob_id}
+            released = blob_ids - set(ImageBlob.objects.filter(pk__in=blob_ids).values_list('pk', flat=True))
+        names = set()
+        for image in images:
+            if not image.blob_id or image.blob_id in released:
+                names |= image.file_names
+        return names
+
+    @staticmethod
+    def size(name):
+        try:
+            return os.path.getsize(default_storage.path(name))
+        except OSError:
+            return 0
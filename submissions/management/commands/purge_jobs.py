@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from submissions.jobs import finished_before, purge_finished
+
+
+class Command(BaseCommand):
+    help = "Delete background jobs that finished (or gave up) a while ago."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Only jobs finished this many days ago (default: JOB_MAX_AGE).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting anything.')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            max_age = timedelta(days=options['days'])
+        else:
+            max_age = timedelta(seconds=settings.JOB_MAX_AGE)
+        cutoff = timezone.now() - max_age
+        if options['dry_run']:
+            self.stdout.write("Would delete %d finished jobs." % finished_before(cutoff).count())
+        else:
+            self.stdout.write("Deleted %d finished jobs." % purge_finished(cutoff))
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from submissions.uploads import ChunkedUpload
+from submissions.utils import human_size
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads that were started but never finished."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int,
+                            help='Only uploads untouched for this many hours (default: CHUNKED_UPLOAD_MAX_AGE).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be deleted without deleting anything.')
+
+    def handle(self, *args, **options):
+        max_age = settings.CHUNKED_UPLOAD_MAX_AGE
+        if options['hours'] is not None:
+            max_age = options['hours'] * 60 * 60
+        uploads, reclaimed = ChunkedUpload.purge_stale(max_age, dry_run=options['dry_run'])
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write("%s %d partial uploads (%s)." % (verb, uploads, human_size(reclaimed)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from submissions import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from scratch."
+
+    def handle(self, *args, **options):
+        if not search.enabled():
+            self.stdout.write("Full-text search needs SQLite; nothing to rebuild.")
+            return
+        with transaction.atomic():
+            count = search.rebuild()
+        self.stdout.write("Indexed %d submissions." % count)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from submissions.markup import render_markdown, renderer_version
+from submissions.models import Submission
+
+
+class Command(BaseCommand):
+    help = "Re-render submission text whose stored HTML came from different Markdown settings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render every submission, not just outdated ones.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        version = renderer_version()
+        submissions = Submission.objects.only('id', 'text').order_by('id')
+        if not options['all']:
+            submissions = submissions.exclude(text_html_version=version)
+
+        batch, rendered = [], 0
+        for sub in submissions.iterator(chunk_size=options['batch_size']):
+            sub.text_html = render_markdown(sub.text)
+            sub.text_html_version = version
+            batch.append(sub)
+            if len(batch) >= options['batch_size']:
+                rendered += self.flush(batch)
+        rendered += self.flush(batch)
+        self.stdout.write("Rendered %d submissions." % rendered)
+
+    def flush(self, batch):
+        Submission.objects.bulk_update(batch, ['text_html', 'text_html_version'])
+        count = len(batch)
+        batch.clear()
+        return count
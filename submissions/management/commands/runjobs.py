@@ -0,0 +1,55 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from submissions.jobs import claim, run_job
+from submissions.models import Job
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # Never share the parent's database connection across a fork
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (image processing) in a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Size of the process pool; 0 runs jobs in this process.')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling forever.')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        pool = None
+        if workers > 0:
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+        try:
+            while True:
+                job_ids = claim(max(workers, 1) * 2)
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                if pool:
+                    states = list(pool.map(run_job, job_ids))
+                else:
+                    states = [run_job(job_id) for job_id in job_ids]
+                self.stdout.write("Ran %d jobs (%d failed)." % (
+                    len(states), sum(1 for state in states if state != Job.DONE)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool:
+                pool.shutdown()
@@ -0,0 +1,155 @@
+import hashlib
+import io
+import random
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from submissions import search
+from submissions.embeds import link_fields
+from submissions.feedcache import bump_feed_version
+from submissions.markup import render_markdown, renderer_version
+from submissions.models import Image, ImageBlob, Link, Submission
+
+# (photos per submission, weight): most people share a story and a photo or
+# two, a few upload an album.
+IMAGE_COUNTS = ((0, 30), (1, 30), (2, 12), (3, 8), (4, 5), (6, 8), (12, 5), (25, 2))
+LINK_COUNTS = ((0, 70), (1, 20), (2, 7), (4, 3))
+
+FIRST_NAMES = ('May', 'Tom', 'Rosa', 'Ahmed', 'Grace', 'Luis', 'Hannah', 'Kenji', 'Olga', 'Sam')
+RELATIONS = ('Aunt', 'Uncle', 'Cousin', 'Neighbor', 'Coach', 'Friend', 'Colleague', '')
+WORDS = ('summer lake fishing laugh kitchen garden stories music always remember '
+         'patient kind stubborn road trip birthday church school porch coffee letters '
+         'taught us dance piano hiking snow holidays grandchildren proud generous').split()
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+def make_story(rng):
+    """A few paragraphs of Markdown, sometimes with emphasis and a list."""
+    paragraphs = []
+    for _ in range(rng.choice((1, 1, 2, 3, 5))):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(15, 120))]
+        if rng.random() < 0.3:
+            i = rng.randrange(len(words))
+            words[i] = '*%s*' % words[i]
+        paragraphs.append(' '.join(words).capitalize() + '.')
+    if rng.random() < 0.15:
+        paragraphs.append('\n'.join('- ' + rng.choice(WORDS) for _ in range(rng.randint(2, 5))))
+    return '\n\n'.join(paragraphs)
+
+
+def make_photo(rng, size=(1600, 1200)):
+    """JPEG bytes of a random scene, noisy enough to compress like a photo."""
+    from PIL import Image as PILImage, ImageDraw
+
+    img = PILImage.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        w, h = rng.randrange(50, size[0] // 2), rng.randrange(50, size[1] // 2)
+        draw.ellipse((x, y, x + w, y + h), fill=tuple(rng.randrange(256) for _ in range(3)))
+    noise = PILImage.effect_noise(size, 40).convert('RGB')
+    img = PILImage.blend(img, noise, 0.15)
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=85)
+    return out.getvalue()
+
+
+def make_link(rng, pk, i):
+    """Link field values for a YouTube video, as a resolved oEmbed lookup leaves them."""
+    video_id = hashlib.sha256(b'%d-%d' % (pk, i)).hexdigest()[:11]
+    url = 'https://www.youtube.com/watch?v=%s' % video_id
+    fields = link_fields(url, {
+        'provider_name': 'YouTube',
+        'html': '<iframe width="200" height="113" src="https://www.youtube.com/embed/%s?feature=oembed" '
+                'frameborder="0" allowfullscreen></iframe>' % video_id,
+        'thumbnail_url': 'https://i.ytimg.com/vi/%s/hqdefault.jpg' % video_id,
+    })
+    return Link(link=url, description=rng.choice(('', '', 'At the reunion', 'Her favorite song')), **fields)
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with a realistic memorial (submissions, photos, videos) "
+            "for benchmarking. Adds to whatever is already there.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submissions', type=int, default=500)
+        parser.add_argument('--photos', type=int, default=40,
+                            help='Distinct JPEGs to generate; submissions share them (default: 40).')
+        parser.add_argument('--drafts', type=float, default=0.1,
+                            help='Fraction of submissions left unsent (default: 0.1).')
+        parser.add_argument('--unapproved', type=float, default=0.1,
+                            help='Fraction of sent submissions not yet approved (default: 0.1).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        blobs = self.make_blobs(rng, options['photos'])
+        self.stdout.write("Generated %d photos." % len(blobs))
+
+        now = timezone.now()
+        version = renderer_version()
+        with transaction.atomic():
+            last_id = Submission.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            submissions = []
+            for _ in range(options['submissions']):
+                text = make_story(rng) if rng.random() < 0.85 else ''
+                sent = None if rng.random() < options['drafts'] else now - timedelta(
+                    seconds=rng.randrange(60 * 24 * 60 * 60))
+                accepted = sent if sent and rng.random() >= options['unapproved'] else None
+                submissions.append(Submission(
+                    name='%s %s' % (rng.choice(RELATIONS), rng.choice(FIRST_NAMES)) if sent else '',
+                    text=text, text_html=render_markdown(text), text_html_version=version,
+                    submitted_at=sent, accepted_at=accepted,
+                ))
+            Submission.objects.bulk_create(submissions, batch_size=options['batch_size'])
+            # SQLite doesn't return bulk-inserted ids; nothing else writes during seeding
+            ids = list(Submission.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+            images, links, uses = [], [], {}
+            for pk in ids:
+                for order in range(weighted(rng, IMAGE_COUNTS) if blobs else 0):
+                    blob, processed = rng.choice(blobs)
+                    uses[blob.pk] = uses.get(blob.pk, 0) + 1
+                    images.append(Image(submission_id=pk, file=blob.file, blob=blob, order=order,
+                                        status=Image.READY, **processed))
+                for i in range(weighted(rng, LINK_COUNTS)):
+                    link = make_link(rng, pk, i)
+                    link.submission_id = pk
+                    links.append(link)
+            Image.objects.bulk_create(images, batch_size=options['batch_size'])
+            Link.objects.bulk_create(links, batch_size=options['batch_size'])
+            for blob, processed in blobs:
+                if blob.pk in uses:
+                    # One reference was taken when the blob was stored
+                    ImageBlob.objects.filter(pk=blob.pk).update(refcount=blob.refcount - 1 + uses[blob.pk])
+                elif ImageBlob.objects.release(blob.pk):
+                    Image(file=blob.file, **processed).delete_files()
+            # bulk_create skips the receivers that keep the index current
+            search.rebuild()
+        bump_feed_version()
+        self.stdout.write("Created %d submissions with %d images and %d links." % (
+            len(ids), len(images), len(links)))
+
+    def make_blobs(self, rng, count):
+        """Store ``count`` generated photos, processed: [(blob, Image.processed_fields)]."""
+        blobs, seen = [], set()
+        for _ in range(count):
+            data = make_photo(rng, rng.choice(((1600, 1200), (1200, 1600), (2000, 1333), (800, 600))))
+            sha256 = hashlib.sha256(data).hexdigest()
+            if sha256 in seen:
+                continue
+            seen.add(sha256)
+            blob, _ = ImageBlob.objects.acquire(sha256, ContentFile(data, name='seed.jpg'))
+            image = Image(file=blob.file)
+            image.build_derivatives()
+            blobs.append((blob, image.processed_fields))
+        return blobs
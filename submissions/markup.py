@@ -0,0 +1,30 @@
+"""Markdown rendering for submission text, done once when a submission is saved."""
+import hashlib
+import json
+
+import markdown2
+from django.conf import settings
+
+
+def renderer_version():
+    """Short fingerprint of everything that affects the rendered HTML.
+
+    Stored next to each rendered text; rows with a different fingerprint are
+    picked up by ``manage.py render_markdown``.
+    """
+    config = {
+        'markdown2': markdown2.__version__,
+        'extras': getattr(settings, 'MARKDOWN_EXTRAS', {}),
+        'safe_mode': getattr(settings, 'MARKDOWN_SAFE_MODE', False),
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def render_markdown(text):
+    if not text:
+        return ''
+    return markdown2.markdown(
+        text,
+        extras=getattr(settings, 'MARKDOWN_EXTRAS', {}),
+        safe_mode=getattr(settings, 'MARKDOWN_SAFE_MODE', False),
+    )
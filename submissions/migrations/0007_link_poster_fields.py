@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0006_embed_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='provider',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='thumbnail_url',
+            field=models.URLField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='video_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:23
+
+from django.db import migrations, models
+
+
+def render_existing(apps, schema_editor):
+    from submissions.markup import render_markdown, renderer_version
+
+    Submission = apps.get_model('submissions', 'Submission')
+    version = renderer_version()
+    for sub in Submission.objects.exclude(text='').only('id', 'text').iterator():
+        Submission.objects.filter(pk=sub.pk).update(
+            text_html=render_markdown(sub.text), text_html_version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0007_link_poster_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='text_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='text_html_version',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
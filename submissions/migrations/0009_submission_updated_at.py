@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-17 20:25
+
+from django.db import migrations, models
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Rows that predate the field would otherwise look edited just now
+    Submission = apps.get_model('submissions', 'Submission')
+    Submission.objects.update(updated_at=models.F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0008_submission_text_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
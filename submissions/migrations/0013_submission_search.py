@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return  # search falls back to unranked LIKE queries
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE submissions_search USING fts5("
+        "name, text, links, tokenize='porter unicode61 remove_diacritics 2')")
+    schema_editor.execute(
+        "INSERT INTO submissions_search (rowid, name, text, links) "
+        "SELECT s.id, COALESCE(s.name, ''), s.text, COALESCE((SELECT group_concat(l.description, ' ') "
+        "FROM submissions_link l WHERE l.submission_id = s.id), '') "
+        "FROM submissions_submission s WHERE s.submitted_at IS NOT NULL")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE submissions_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('submissions', '0012_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,10 +1,76 @@
-from django.db import models
+import os
+
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Max, Subquery, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.urls import reverse
-import micawber
+from django.utils import timezone
+
+class SubmissionQuerySet(models.QuerySet):
+
+    @staticmethod
+    def feed_field():
+        """The timestamp the feed filters and sorts on."""
+        from mysite.context_processors import get_site_config
+        return 'accepted_at' if get_site_config('REQUIRE_APPROVAL', False) else 'submitted_at'
+
+    def published(self):
+        """Submissions visible on the public feed, newest first."""
+        field = self.feed_field()
+        return self.filter(**{field + '__isnull': False}).order_by('-' + field, '-id')
+
+    def abandoned(self, cutoff):
+        """Drafts never sent and not edited since ``cutoff``."""
+        return self.filter(submitted_at__isnull=True, updated_at__lt=cutoff)
+
+    def touch(self):
+        """Mark these submissions as changed, e.g. after editing their media.
+
+        Refreshes ``updated_at`` (which keys their cached feed fragment) and
+        invalidates cached feed pages if any of them is on the feed.
+        """
+        from .feedcache import bump_feed_version
+        self.update(updated_at=timezone.now())
+        if self.filter(submitted_at__isnull=False).exists():
+            bump_feed_version()
+
+    def approve(self, user):
+        """Approve the sent, not yet approved submissions here with one UPDATE.
+
+        Returns the number approved. Bypasses ``save()``, so the feed cache
+        is invalidated explicitly.
+        """
+        from .feedcache import bump_feed_version
+        now = timezone.now()
+        count = self.filter(submitted_at__isnull=False, accepted_at__isnull=True).update(
+            accepted_at=now, accepted_by=user, updated_at=now)
+        if count:
+            bump_feed_version()
+        return count
+
+    def unapprove(self):
+        """Withdraw approval with one UPDATE; returns the number changed."""
+        from .feedcache import bump_feed_version
+        count = self.filter(accepted_at__isnull=False).update(
+            accepted_at=None, accepted_by=None, updated_at=timezone.now())
+        if count:
+            bump_feed_version()
+        return count
+
+    def for_feed(self):
+        """Project only what the feed renders and prefetch its media in order."""
+        return self.only('id', 'name', 'text_html', 'submitted_at', 'accepted_at', 'updated_at').prefetch_related(
+            # Leading with submission_id lets the indexes return rows pre-sorted
+            models.Prefetch('image_set', queryset=Image.objects.order_by('submission_id', 'order', 'id')),
+            models.Prefetch('link_set', queryset=Link.objects.order_by('submission_id', 'id')),
+        )
+
 
 class Submission(models.Model):
     date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     submitted_at = models.DateTimeField(null=True, blank=True)
     accepted_at = models.DateTimeField(null=True, blank=True)
     accepted_by = models.ForeignKey(User, null=True, blank=True, related_name='accepted_submissions', on_delete=models.SET_NULL)
@@ -13,21 +79,219 @@ class Submission(models.Model):
     email = models.CharField(max_length=200, blank=True, null=True, verbose_name='Email (optional, not public)')
 
     text = models.TextField(blank=True, verbose_name='Story or memory you\'d like to share (required if no photos)')
+    # `text` rendered from Markdown on save, and the renderer_version() used
+    text_html = models.TextField(blank=True, editable=False)
+    text_html_version = models.CharField(max_length=12, blank=True, editable=False)
+
+    objects = SubmissionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The feed (keyset-paginated on these) and the moderation filter
+            models.Index(fields=['submitted_at', 'id'], name='submission_sent_idx'),
+            models.Index(fields=['accepted_at', 'id'], name='submission_accepted_idx'),
+            # "Submitted and approved" in the admin, newest first
+            models.Index(fields=['id'], condition=models.Q(accepted_at__isnull=False),
+                         name='submission_approved_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'text' in update_fields:
+            self.render_text()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'text_html', 'text_html_version'}
+        super(Submission, self).save(*args, **kwargs)
+
+    def render_text(self):
+        from .markup import render_markdown, renderer_version
+        self.text_html = render_markdown(self.text)
+        self.text_html_version = renderer_version()
 
     def get_absolute_url(self):
         return reverse('submission-edit', kwargs={'pk': self.id})
 
     @property
     def current_files(self):
-        return [x for x in self.image_set.all().order_by('order', 'id') if x.file]
+        if 'image_set' in getattr(self, '_prefetched_objects_cache', {}):
+            # Already ordered by SubmissionQuerySet.for_feed()
+            images = self.image_set.all()
+        else:
+            images = self.image_set.all().order_by('order', 'id')
+        return [x for x in images if x.file]
+
+    def reorder_images(self, image_ids):
+        """Put the images in ``image_ids`` first, in that order, with one UPDATE.
+
+        Images not listed (e.g. still uploading when the list was sent) keep
+        their relative order after them. Raises ValueError if an id is
+        repeated or isn't one of this submission's images.
+        """
+        with transaction.atomic():
+            # Writing to the submission first locks it (its row, or the whole
+            # SQLite database) until commit, so the ids read next stay valid.
+            Submission.objects.filter(pk=self.pk).touch()
+            current = list(Image.objects.filter(submission=self)
+                           .order_by('order', 'id').values_list('pk', flat=True))
+            listed = set(image_ids)
+            if len(listed) != len(image_ids) or not listed <= set(current):
+                raise ValueError("Not a reordering of this submission's images")
+            permutation = list(image_ids) + [pk for pk in current if pk not in listed]
+            if permutation:
+                Image.objects.filter(submission=self).update(order=Case(
+                    *[When(pk=pk, then=Value(order)) for order, pk in enumerate(permutation)],
+                    output_field=models.PositiveIntegerField()))
 
     def __str__(self):
         return 'Submission by %s (%s)' % (self.name, (self.text or '')[:20])
 
+class ImageBlobManager(models.Manager):
+
+    def acquire(self, sha256, upload):
+        """Take a reference to the blob holding ``upload``'s content.
+
+        The file is only written to storage the first time its content is
+        seen. Returns ``(blob, created)``.
+        """
+        blob = self.filter(sha256=sha256).first()
+        # No rows updated: it was released since we looked, so store it afresh
+        if blob and self.filter(pk=blob.pk).update(refcount=F('refcount') + 1):
+            return blob, False
+        ext = os.path.splitext(upload.name)[1].lower() or '.jpg'
+        name = default_storage.save(sha256 + ext, upload)
+        try:
+            with transaction.atomic():
+                return self.create(sha256=sha256, file=name, size=upload.size, refcount=1), True
+        except IntegrityError:
+            # A concurrent upload of the same content got there first
+            default_storage.delete(name)
+            self.filter(sha256=sha256).update(refcount=F('refcount') + 1)
+            return self.get(sha256=sha256), False
+
+    def release(self, blob_id):
+        """Drop a reference; returns True if that was the last one (the blob is gone)."""
+        with transaction.atomic():
+            self.filter(pk=blob_id, refcount__gt=0).update(refcount=F('refcount') - 1)
+            return bool(self.filter(pk=blob_id, refcount=0).delete()[0])
+
+
+class ImageBlob(models.Model):
+    """An uploaded file stored once, under its SHA-256, however many Images use it.
+
+    ``refcount`` is the number of Image rows pointing here; the file and its
+    derivatives are removed when it drops to zero.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.CharField(max_length=100)
+    size = models.PositiveIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ImageBlobManager()
+
+    def __str__(self):
+        return self.file
+
+
 class Image(models.Model):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Waiting to be processed'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Processing failed'),
+    )
+    # Everything processing works out for a file, shared by Images using it
+    PROCESSED_FIELDS = ('derivatives', 'width', 'height', 'color', 'placeholder')
+
     submission = models.ForeignKey(Submission, on_delete=models.CASCADE)
     file = models.ImageField()
     order = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY)
+    # Shared storage for ``file``; empty for images uploaded before deduplication
+    blob = models.ForeignKey(ImageBlob, null=True, blank=True, on_delete=models.PROTECT)
+    # Resized/WebP copies of ``file``: [{'name', 'width', 'format'}, ...]
+    derivatives = models.JSONField(default=list, blank=True)
+    # Filled in with the derivatives, so the feed can reserve the photo's
+    # space and paint something while it loads
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    color = models.CharField(max_length=7, blank=True)
+    placeholder = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['submission', 'order', 'id'], name='image_order_idx')]
+
+    def move_to_end(self):
+        """Set ``order`` one past the submission's other images, atomically.
+
+        A single UPDATE computes MAX(order) + 1 while the submission is
+        locked, so parallel uploads to one submission never get the same
+        position.
+        """
+        others = (Image.objects.filter(submission_id=self.submission_id).exclude(pk=self.pk)
+                  .order_by().values('submission_id').annotate(last=Max('order')).values('last'))
+        with transaction.atomic():
+            Submission.objects.filter(pk=self.submission_id).touch()
+            Image.objects.filter(pk=self.pk).update(order=Coalesce(Subquery(others), -1) + 1)
+        self.refresh_from_db(fields=['order'])
+
+    def build_derivatives(self):
+        """Write the resized copies and measure the file for its placeholder."""
+        from .imaging import build_derivatives, placeholder_fields
+        self.derivatives = build_derivatives(self.file.path, self.file.name)
+        for field, value in placeholder_fields(self.file.path).items():
+            setattr(self, field, value)
+
+    @property
+    def processed_fields(self):
+        return {field: getattr(self, field) for field in self.PROCESSED_FIELDS}
+
+    def srcset(self, webp=False):
+        return ', '.join(
+            '%s %dw' % (default_storage.url(d['name']), d['width'])
+            for d in self.derivatives if (d['format'] == 'webp') == webp
+        )
+
+    @property
+    def webp_srcset(self):
+        return self.srcset(webp=True)
+
+    @property
+    def fallback_srcset(self):
+        return self.srcset(webp=False)
+
+    @property
+    def thumbnail_url(self):
+        """URL of the smallest stored copy, falling back to the original."""
+        smallest = min(self.derivatives, key=lambda d: (d['width'], d['format'] == 'webp'), default=None)
+        return default_storage.url(smallest['name']) if smallest else self.file.url
+
+    @property
+    def file_names(self):
+        """Storage names of the original and every derivative."""
+        names = {d['name'] for d in self.derivatives}
+        if self.file:
+            names.add(self.file.name)
+        return names
+
+    @property
+    def siblings(self):
+        """Images sharing this one's file, itself included."""
+        if self.blob_id:
+            return Image.objects.filter(blob_id=self.blob_id)
+        return Image.objects.filter(pk=self.pk)
+
+    def delete_files(self):
+        """Remove the original and all derivatives from MEDIA_ROOT."""
+        for name in self.file_names:
+            try:
+                os.unlink(default_storage.path(name))
+            except OSError:
+                pass
 
 class Link(models.Model):
     submission = models.ForeignKey(Submission, on_delete=models.CASCADE)
@@ -35,12 +299,75 @@ class Link(models.Model):
     description = models.CharField(max_length=255, null=True, blank=True, verbose_name="Caption (optional)")
 
     embed = models.TextField(null=True,blank=True)
+    # Pulled from the oEmbed response so the feed can show a poster first
+    provider = models.CharField(max_length=50, blank=True)
+    video_id = models.CharField(max_length=100, blank=True)
+    thumbnail_url = models.URLField(max_length=500, blank=True)
 
     def save(self, *args, **kwargs):
-        providers = micawber.bootstrap_basic()
-        try:
-            self.embed = providers.request(self.link)['html']
-        except micawber.ProviderException as e:
-            self.embed = None
+        from mysite.timing import timed
+        from .embeds import cached_embed
+        from .jobs import enqueue
+        with timed('oembed'):
+            fields, needs_fetch = cached_embed(self.link)
+        for name, value in fields.items():
+            setattr(self, name, value)
         super(Link, self).save(*args, **kwargs)
+        if needs_fetch:
+            enqueue('resolve_link', self.pk)
 
+
+class EmbedCache(models.Model):
+    """oEmbed response per URL; ``data`` is None when the lookup failed."""
+    url = models.CharField(max_length=255, unique=True)
+    data = models.JSONField(null=True, blank=True)
+    fetched_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+
+    @property
+    def html(self):
+        return self.data.get('html') if self.data else None
+
+    def __str__(self):
+        return self.url
+
+
+class Job(models.Model):
+    """A unit of background work, run by ``manage.py runjobs``."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATE_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    task = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['state', 'run_after'])]
+
+    def __str__(self):
+        return '%s(%s) [%s]' % (self.task, self.object_id, self.state)
+
+
+class Notification(models.Model):
+    """Outbox entry: the admin is to be told about this submission."""
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return 'Notification for submission %s' % self.submission_id
@@ -0,0 +1,104 @@
+"""Email notifications about new submissions, sent from an outbox.
+
+Sending a submission writes a ``Notification`` row in the same transaction
+as ``submitted_at`` and, once that commits, queues a
+``deliver_notifications`` job, so the family member's request never waits
+on the mail server and no notification is lost if it is down: the job is
+retried with backoff by ``manage.py runjobs``, and every delivery sends
+whatever is still pending.
+
+With NOTIFICATION_DIGEST_MINUTES set, delivery waits that long and then
+sends everything pending in one email. That job is queued for the worker
+even with JOBS_RUN_INLINE.
+"""
+import subprocess
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from mysite.context_processors import get_site_config
+from mysite.timing import timed
+
+from .jobs import enqueue
+from .models import Notification
+
+SENDMAIL_TIMEOUT = 30
+
+
+def queue_notification(submission):
+    """Add ``submission`` to the outbox; call inside the transaction that sends it."""
+    if not get_site_config('NOTIFICATION_EMAIL', ''):
+        return None
+    notification = Notification.objects.create(submission=submission)
+    window = get_site_config('NOTIFICATION_DIGEST_MINUTES', 0)
+    run_after = notification.created_at + timedelta(minutes=window) if window else None
+    # Not before the commit: inline, or for a quick worker, the row must be there
+    transaction.on_commit(lambda: enqueue('deliver_notifications', notification.pk, run_after=run_after))
+    return notification
+
+
+def admin_url(submission_id):
+    return "https://%s/admin/submissions/submission/%s/change/" % (
+        settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost',
+        submission_id,
+    )
+
+
+def compose(notifications, from_email, to_email):
+    """The email (headers and body) announcing ``notifications``' submissions."""
+    names = [n.submission.name or 'Anonymous' for n in notifications]
+    if len(notifications) == 1:
+        subject = "New submission from %s" % names[0]
+        body = "New submission received.\n\nFrom: %s\n\nView in admin: %s\n" % (
+            names[0], admin_url(notifications[0].submission_id))
+    else:
+        subject = "%d new submissions" % len(notifications)
+        body = "%d new submissions received.\n\n%s" % (len(notifications), ''.join(
+            "From: %s\nView in admin: %s\n\n" % (name, admin_url(n.submission_id))
+            for name, n in zip(names, notifications)))
+    return "From: %s\nTo: %s\nSubject: %s\nContent-Type: text/plain; charset=utf-8\n\n%s" % (
+        from_email, to_email, subject, body,
+    )
+
+
+@timed('sendmail')
+def sendmail(message):
+    """Pipe ``message`` to sendmail; raises if it fails, so the job is retried."""
+    sendmail_cmd = get_site_config('SENDMAIL_COMMAND', '/usr/sbin/sendmail')
+    proc = subprocess.run(
+        [sendmail_cmd, '-t'],
+        input=message.encode('utf-8'),
+        capture_output=True,
+        timeout=SENDMAIL_TIMEOUT,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError("sendmail failed (exit %d): %s" % (
+            proc.returncode, proc.stderr.decode('utf-8', errors='replace')))
+
+
+def deliver_pending():
+    """Send every pending notification in one email. Returns how many went out."""
+    pending = list(Notification.objects.filter(sent_at__isnull=True, created_at__lte=timezone.now())
+                   .select_related('submission').order_by('created_at', 'id'))
+    if not pending:
+        return 0  # already sent as part of an earlier digest
+    ids = [n.pk for n in pending]
+    to_email = get_site_config('NOTIFICATION_EMAIL', '')
+    # Claim the rows first so a second worker doesn't send them as well
+    now = timezone.now()
+    claimed = Notification.objects.filter(pk__in=ids, sent_at__isnull=True).update(sent_at=now)
+    if claimed != len(ids):
+        # Another worker is sending them; if it fails, its job's retry will
+        # pick these up too
+        Notification.objects.filter(pk__in=ids, sent_at=now).update(sent_at=None)
+        return 0
+    if not to_email:
+        return 0  # notifications were switched off after these were queued
+    try:
+        sendmail(compose(pending, get_site_config('NOTIFICATION_FROM', to_email), to_email))
+    except Exception:
+        Notification.objects.filter(pk__in=ids).update(sent_at=None)
+        raise
+    return len(pending)
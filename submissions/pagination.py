@@ -0,0 +1,51 @@
+"""Keyset ("cursor") pagination for the feed.
+
+Instead of ``OFFSET n`` plus a ``COUNT(*)`` on every request, each page ends
+with a cursor naming its last row, ``<microseconds>-<id>``, and the next page
+starts right after it. Deep pages cost the same as the first.
+"""
+from datetime import datetime, timedelta
+
+from django.http import Http404
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_cursor(moment, pk):
+    delta = moment - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return '%d-%d' % (micros, pk)
+
+
+def decode_cursor(cursor):
+    try:
+        micros, pk = cursor.split('-')
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (ValueError, OverflowError):
+        raise Http404('Invalid cursor')
+
+
+class FeedPage:
+    """One page of a queryset ordered by ``(-<field>, -id)``."""
+
+    def __init__(self, queryset, field, cursor=None, size=10):
+        self.cursor = cursor or None
+        if self.cursor:
+            moment, pk = decode_cursor(self.cursor)
+            # Same rows as "(field, id) < (moment, pk)", but written so the
+            # (field, id) index serves it as a single range scan.
+            queryset = queryset.filter(**{field + '__lte': moment}).exclude(
+                **{field: moment, 'id__gte': pk})
+
+        rows = list(queryset[:size + 1])
+        self.items = rows[:size]
+        self.has_next = len(rows) > size
+        self.next_cursor = None
+        if self.has_next:
+            last = self.items[-1]
+            self.next_cursor = encode_cursor(getattr(last, field), last.pk)
+
+    @property
+    def is_first(self):
+        return self.cursor is None
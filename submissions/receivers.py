@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .feedcache import bump_feed_version
+from .jobs import enqueue
+from .models import Image, ImageBlob, Link, Submission
+
+
+@receiver(post_save, sender=Submission)
+@receiver(post_delete, sender=Submission)
+def handle_submission_changed(sender, instance, **kwargs):
+    # Drafts aren't on the feed; sending one sets submitted_at and lands here
+    if instance.submitted_at:
+        bump_feed_version()
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+def handle_media_changed(sender, instance, **kwargs):
+    Submission.objects.filter(pk=instance.submission_id).touch()
+
+
+@receiver(post_delete, sender=Image)
+def release_image_files(sender, instance, **kwargs):
+    """Remove a deleted image's files, unless another Image still shares them."""
+    if instance.blob_id and not ImageBlob.objects.release(instance.blob_id):
+        if instance.status == Image.PENDING:
+            # Its queued process_image job will find it gone; hand the work on
+            sibling = instance.siblings.filter(status=Image.PENDING).first()
+            if sibling:
+                enqueue('process_image', sibling.pk)
+        return
+    transaction.on_commit(instance.delete_files)
+
+
+@receiver(post_save, sender=Submission)
+def index_submission(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'text', 'submitted_at'} & set(update_fields):
+        search.index_submission(instance.pk)
+
+
+@receiver(post_delete, sender=Submission)
+def unindex_submission(sender, instance, **kwargs):
+    search.remove_submission(instance.pk)
+
+
+@receiver(post_save, sender=Link)
+@receiver(post_delete, sender=Link)
+def index_link_caption(sender, instance, **kwargs):
+    search.index_submission(instance.submission_id)
@@ -0,0 +1,133 @@
+"""Full-text search over submissions, backed by an SQLite FTS5 table.
+
+``submissions_search`` (created by migration 0013) holds one row per sent
+submission, with ``rowid`` = submission id and columns for the name, the
+story and the link captions. The receivers keep it current as submissions
+and links are saved and deleted; ``manage.py rebuild_search`` refills it
+from scratch.
+
+Only sent submissions are indexed. Whether one is visible (approved, with
+REQUIRE_APPROVAL) is checked when searching, so approving doesn't touch
+the index. On other databases search falls back to unranked LIKE queries.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Link, Submission
+
+TABLE = 'submissions_search'
+MAX_TERMS = 10
+# highlight()/snippet() markers, swapped for <mark> once the text is escaped
+START, END = '\x02', '\x03'
+
+LINK_TEXT = ("COALESCE((SELECT group_concat(l.description, ' ') FROM %s l "
+             "WHERE l.submission_id = s.id), '')" % Link._meta.db_table)
+
+
+def enabled():
+    return connection.vendor == 'sqlite'
+
+
+def index_submission(submission_id):
+    """Bring the index row for ``submission_id`` up to date."""
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s WHERE rowid = %%s" % TABLE, [submission_id])
+        cursor.execute(
+            "INSERT INTO %s (rowid, name, text, links) SELECT s.id, COALESCE(s.name, ''), s.text, %s "
+            "FROM %s s WHERE s.id = %%s AND s.submitted_at IS NOT NULL"
+            % (TABLE, LINK_TEXT, Submission._meta.db_table), [submission_id])
+
+
+def remove_submission(submission_id):
+    if not enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s WHERE rowid = %%s" % TABLE, [submission_id])
+
+
+def rebuild():
+    """Re-index every sent submission; returns how many there are."""
+    if not enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s" % TABLE)
+        cursor.execute(
+            "INSERT INTO %s (rowid, name, text, links) SELECT s.id, COALESCE(s.name, ''), s.text, %s "
+            "FROM %s s WHERE s.submitted_at IS NOT NULL"
+            % (TABLE, LINK_TEXT, Submission._meta.db_table))
+        count = cursor.rowcount
+        cursor.execute("INSERT INTO %s (%s) VALUES ('optimize')" % (TABLE, TABLE))
+    return count
+
+
+def match_expression(query):
+    """FTS5 query for the words in ``query``: all of them, the last as a prefix.
+
+    Every word is quoted, so FTS5 operators typed by visitors are just words.
+    """
+    terms = re.findall(r'\w+', query)[:MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join('"%s"' % term for term in terms) + '*'
+
+
+def highlighted(text):
+    return mark_safe(escape(text).replace(START, '<mark>').replace(END, '</mark>'))
+
+
+class SearchResult:
+
+    def __init__(self, submission, name, snippet):
+        self.submission = submission
+        self.name = name
+        self.snippet = snippet
+
+
+class SearchPage:
+    """One page of ranked results for ``query``: ``results``, ``has_next``."""
+
+    def __init__(self, query, page=1, size=10):
+        self.query = query
+        self.page = page
+        self.results = []
+        self.has_next = False
+        self.expression = match_expression(query)
+        if self.expression is None:
+            return
+
+        offset = (page - 1) * size
+        rows = self.fts_rows(offset, size + 1) if enabled() else self.like_rows(offset, size + 1)
+        self.has_next = len(rows) > size
+        rows = rows[:size]
+        submissions = Submission.objects.for_feed().in_bulk([pk for pk, _, _ in rows])
+        self.results = [SearchResult(submissions[pk], highlighted(name), highlighted(snippet))
+                        for pk, name, snippet in rows if pk in submissions]
+
+    def fts_rows(self, offset, limit):
+        """``(id, name, snippet)`` best match first, with highlight markers."""
+        field = Submission.objects.feed_field()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT {t}.rowid, highlight({t}, 0, %s, %s), snippet({t}, -1, %s, %s, '…', 24) "
+                "FROM {t} JOIN {s} s ON s.id = {t}.rowid "
+                "WHERE {t} MATCH %s AND s.{field} IS NOT NULL "
+                # A name match weighs double; link captions count like the story
+                "ORDER BY bm25({t}, 2.0, 1.0, 1.0), {t}.rowid DESC LIMIT %s OFFSET %s".format(
+                    t=TABLE, s=Submission._meta.db_table, field=field),
+                [START, END, START, END, self.expression, limit, offset])
+            return cursor.fetchall()
+
+    def like_rows(self, offset, limit):
+        condition = Q()
+        for term in re.findall(r'\w+', self.query)[:MAX_TERMS]:
+            in_story = Q(name__icontains=term) | Q(text__icontains=term)
+            condition &= in_story | Q(link__description__icontains=term)
+        matches = Submission.objects.published().filter(condition).distinct()
+        return [(pk, name or '', text[:200])
+                for pk, name, text in matches.values_list('id', 'name', 'text')[offset:offset + limit]]
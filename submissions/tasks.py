@@ -0,0 +1,46 @@
+"""Background tasks, registered by name in ``submissions.jobs.TASKS``."""
+from .embeds import link_fields, resolve
+from .imaging import compress_image
+from .models import Image, Link, Submission
+
+
+def process_image(image_id):
+    """Compress an uploaded image, write its derivatives and measure it.
+
+    The results go to every Image sharing the same file, so a photo
+    uploaded to several submissions is processed once.
+    """
+    image = Image.objects.filter(pk=image_id).first()
+    if image is None or not image.file:
+        return  # deleted before we got to it
+    if image.status == Image.READY and image.derivatives:
+        return  # already done through another Image with the same file
+
+    siblings = image.siblings
+    siblings.update(status=Image.PROCESSING)
+    try:
+        compress_image(image.file.path)
+        image.build_derivatives()
+    except Exception:
+        siblings.update(status=Image.FAILED)
+        raise
+    siblings.update(status=Image.READY, **image.processed_fields)
+    Submission.objects.filter(pk__in=siblings.values('submission_id')).touch()
+
+
+def resolve_link(link_id):
+    """Look up a link's oEmbed data and fill in every link to the same URL."""
+    link = Link.objects.filter(pk=link_id).first()
+    if link is None:
+        return
+    entry = resolve(link.link)
+    # update() rather than save(): save() would queue this job again
+    links = Link.objects.filter(link=link.link)
+    links.update(**link_fields(link.link, entry.data))
+    Submission.objects.filter(pk__in=links.values('submission_id')).touch()
+
+
+def deliver_notifications(notification_id):
+    """Email the admin about pending submissions (one email, however many)."""
+    from .notifications import deliver_pending
+    deliver_pending()
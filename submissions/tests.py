@@ -1,3 +1,1448 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import unittest
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase as BaseTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from . import embeds, feedcache, imaging
+from .jobs import claim, enqueue, run_job
+from .models import Submission, Image, ImageBlob, Link, Job, EmbedCache, Notification
+from .pagination import encode_cursor
+from .search import SearchPage
+
+
+def make_submission(images=0, links=0, **kwargs):
+    """Create a sent submission with placeholder media (no files on disk, no oEmbed)."""
+    kwargs.setdefault('name', 'Aunt May')
+    kwargs.setdefault('text', 'We went fishing every summer.')
+    kwargs.setdefault('submitted_at', timezone.now())
+    sub = Submission.objects.create(**kwargs)
+    Image.objects.bulk_create(
+        Image(submission=sub, file='photo-%d-%d.jpg' % (sub.pk, i), order=images - i)
+        for i in range(images)
+    )
+    Link.objects.bulk_create(
+        Link(submission=sub, link='https://example.com/%d/%d' % (sub.pk, i))
+        for i in range(links)
+    )
+    return sub
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestCase(BaseTestCase):
+    """Each test starts with an empty, process-local cache."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+STUB_OEMBED_ENDPOINT = 'http://oembed.stub.test/oembed'
+stub_requests = []
+
+
+def stub_transport(endpoint_url):
+    """Offline stand-in for an oEmbed provider at STUB_OEMBED_ENDPOINT."""
+    stub_requests.append(endpoint_url)
+    if 'missing' in endpoint_url:
+        from micawber import ProviderHTTPException
+        raise ProviderHTTPException(endpoint_url, 404)
+    return json.dumps({
+        'type': 'video',
+        'provider_name': 'Stub',
+        'html': '<iframe src="http://stub.test/embed/1"></iframe>',
+        'thumbnail_url': 'http://stub.test/thumb/1.jpg',
+    })
+
+
+def make_jpeg(width=2400, height=1600, name='photo.jpg'):
+    buf = io.BytesIO()
+    PILImage.new('RGB', (width, height), (120, 80, 40)).save(buf, format='JPEG')
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/jpeg')
+
+
+class MediaRootMixin:
+    """Point MEDIA_ROOT at a throwaway directory for the duration of each test."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def unlock(self, submission):
+        session = self.client.session
+        session['submission_unlocked'] = True
+        session['submission_id'] = submission.pk
+        session.save()
+
+
+class FeedQueryBudgetTest(TestCase):
+    # The validators' aggregate, the page of submissions, then one prefetch
+    # each for images and links.
+    FEED_QUERIES = 4
+
+    def assertFeedQueries(self, url=None):
+        cache.clear()
+        with self.assertNumQueries(self.FEED_QUERIES):
+            response = self.client.get(url or reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_budget_is_independent_of_media_count(self):
+        for i in range(10):
+            make_submission(images=1, links=1)
+        self.assertFeedQueries()
+
+        for i in range(10):
+            make_submission(images=6, links=4)
+        response = self.assertFeedQueries()
+        self.assertFeedQueries(reverse('home') + response.context['next_page_url'])
+
+    def test_images_render_in_order(self):
+        sub = make_submission(images=3)
+        self.assertEqual([image.order for image in sub.current_files], [1, 2, 3])
+        content = self.assertFeedQueries().content
+        positions = [content.find(image.file.name.encode()) for image in sub.current_files]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_current_files_reuses_prefetch(self):
+        make_submission(images=3)
+        sub = Submission.objects.published().for_feed().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(sub.current_files), 3)
+
+
+class ImageDerivativeTest(MediaRootMixin, TestCase):
+
+    def test_upload_writes_derivatives(self):
+        sub = Submission.objects.create()
+        self.unlock(sub)
+        response = self.client.post(reverse('jfu-upload', kwargs={'pk': sub.pk}), {'file': make_jpeg()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['processing'], Image.PENDING)
+        call_command('runjobs', workers=0, once=True, stdout=io.StringIO())
+
+        image = Image.objects.get()
+        self.assertEqual(image.status, Image.READY)
+        self.assertEqual(
+            sorted((d['width'], d['format']) for d in image.derivatives),
+            [(480, 'jpeg'), (480, 'webp'), (960, 'jpeg'), (960, 'webp'),
+             (1600, 'jpeg'), (1600, 'webp'), (2000, 'jpeg'), (2000, 'webp')],
+        )
+        for d in image.derivatives:
+            with PILImage.open(os.path.join(self.media_root, d['name'])) as img:
+                self.assertEqual(img.width, d['width'])
+                self.assertEqual(img.format.lower(), d['format'])
+
+        sub.name, sub.submitted_at = 'Aunt May', timezone.now()
+        sub.save()
+        content = self.client.get(reverse('home')).content.decode()
+        self.assertIn('type="image/webp" srcset="%s' % image.webp_srcset, content)
+        self.assertIn('_480w.webp 480w', content)
+        self.assertEqual((image.width, image.height), (2000, 1333))
+        self.assertIn('width="2000" height="1333"', content)
+        self.assertIn("background: %s url('%s')" % (image.color, image.placeholder), content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('jfu-delete', kwargs={'pk': image.pk}))
+        self.assertEqual(os.listdir(self.media_root), [])
+
+    def test_small_image_keeps_only_webp_copy(self):
+        image = Image.objects.create(submission=Submission.objects.create(), file=make_jpeg(300, 200))
+        image.build_derivatives()
+        self.assertEqual([(d['width'], d['format']) for d in image.derivatives],
+                         [(300, 'jpeg'), (300, 'webp')])
+        self.assertEqual(image.thumbnail_url, image.file.url)
+
+    def test_placeholder(self):
+        image = Image.objects.create(submission=Submission.objects.create(), file=make_jpeg(300, 200))
+        image.build_derivatives()
+        self.assertEqual((image.width, image.height), (300, 200))
+        r, g, b = (int(image.color[i:i + 2], 16) for i in (1, 3, 5))
+        self.assertLess(abs(r - 120) + abs(g - 80) + abs(b - 40), 12)
+        prefix = 'data:image/jpeg;base64,'
+        self.assertTrue(image.placeholder.startswith(prefix))
+        with PILImage.open(io.BytesIO(base64.b64decode(image.placeholder[len(prefix):]))) as img:
+            self.assertEqual(img.size, (16, 11))
+        self.assertLess(len(image.placeholder), 1000)
+
+    def test_transparency_is_laid_over_white(self):
+        buf = io.BytesIO()
+        PILImage.new('RGBA', (100, 100), (0, 0, 0, 0)).save(buf, format='PNG')
+        image = Image.objects.create(submission=Submission.objects.create(),
+                                     file=SimpleUploadedFile('clear.png', buf.getvalue()))
+        image.build_derivatives()
+        self.assertEqual(image.color, '#ffffff')
+
+    def test_backfill_placeholders(self):
+        sub = make_submission()
+        photo = make_jpeg(640, 480)
+        first = Image.objects.create(submission=sub, file=photo)
+        second = Image.objects.create(submission=make_submission(), file=first.file.name)
+        Image.objects.create(submission=sub, file='missing.jpg')
+        Submission.objects.filter(pk=sub.pk).update(updated_at=timezone.now() - timezone.timedelta(days=1))
+        before = Submission.objects.get(pk=sub.pk).updated_at
+
+        out, err = io.StringIO(), io.StringIO()
+        call_command('backfill_placeholders', stdout=out, stderr=err)
+        self.assertIn('Updated 2 images.', out.getvalue())
+        self.assertIn('missing.jpg', err.getvalue())
+        for image in (first, second):
+            image.refresh_from_db()
+            self.assertEqual((image.width, image.height), (640, 480))
+            self.assertTrue(image.placeholder)
+        self.assertGreater(Submission.objects.get(pk=sub.pk).updated_at, before)
+
+        call_command('backfill_placeholders', stdout=out, stderr=err)
+        self.assertIn('Updated 0 images.', out.getvalue())
+
+
+    def test_build_derivatives_once_per_file(self):
+        first = Image.objects.create(submission=make_submission(), file=make_jpeg(640, 480))
+        second = Image.objects.create(submission=make_submission(), file=first.file.name)
+
+        out = io.StringIO()
+        with mock.patch('submissions.imaging.build_derivatives', wraps=imaging.build_derivatives) as build:
+            call_command('build_derivatives', '--all', stdout=out)
+        self.assertEqual(build.call_count, 1)
+        self.assertIn('Built derivatives for 2 images.', out.getvalue())
+        for image in (first, second):
+            image.refresh_from_db()
+            self.assertEqual(len(image.derivatives), 4)
+            self.assertEqual((image.width, image.height), (640, 480))
+            self.assertTrue(image.placeholder)
+
+class JobQueueTest(MediaRootMixin, TestCase):
+
+    def test_upload_returns_before_processing(self):
+        sub = Submission.objects.create()
+        self.unlock(sub)
+        self.client.post(reverse('jfu-upload', kwargs={'pk': sub.pk}), {'file': make_jpeg()})
+        image = Image.objects.get()
+        with PILImage.open(image.file.path) as img:
+            self.assertEqual(img.width, 2400)  # untouched until the worker runs
+
+        status_url = reverse('image-status', kwargs={'pk': sub.pk})
+        self.assertEqual(self.client.get(status_url).json(), {'images': {str(image.pk): 'pending'}})
+        call_command('runjobs', workers=0, once=True, stdout=io.StringIO())
+        self.assertEqual(self.client.get(status_url).json(), {'images': {str(image.pk): 'ready'}})
+        with PILImage.open(image.file.path) as img:
+            self.assertEqual(img.width, 2000)
+
+    def test_claim_hands_out_each_job_once(self):
+        for i in range(5):
+            enqueue('process_image', i)
+        first, second = claim(3), claim(3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(claim(3), [])
+
+    def test_failed_job_is_retried_with_backoff(self):
+        image = Image.objects.create(submission=Submission.objects.create(), file='missing.jpg')
+        job = enqueue('process_image', image.pk)
+        [job_id] = claim(1)
+        with self.assertLogs('submissions', 'ERROR'):
+            self.assertEqual(run_job(job_id), Job.QUEUED)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(claim(1), [])
+        self.assertEqual(Image.objects.get().status, Image.FAILED)
+
+    def test_undecodable_image_fails(self):
+        photo = make_jpeg().read()
+        image = Image.objects.create(submission=Submission.objects.create(),
+                                     file=SimpleUploadedFile('cut.jpg', photo[:len(photo) // 2]))
+        with self.assertRaises(OSError):
+            imaging.compress_image(image.file.path)
+
+        enqueue('process_image', image.pk)
+        [job_id] = claim(1)
+        with self.assertLogs('submissions', 'ERROR'):
+            run_job(job_id)
+        image.refresh_from_db()
+        self.assertEqual((image.status, image.width, image.derivatives), (Image.FAILED, None, []))
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_inline_mode_processes_during_upload(self):
+        sub = Submission.objects.create()
+        self.unlock(sub)
+        response = self.client.post(reverse('jfu-upload', kwargs={'pk': sub.pk}), {'file': make_jpeg()})
+        self.assertEqual(response.json()['processing'], Image.READY)
+        self.assertFalse(Job.objects.exists())
+
+    def test_purge_finished_jobs(self):
+        long_ago = timezone.now() - timezone.timedelta(days=30)
+        for state in (Job.DONE, Job.FAILED, Job.QUEUED):
+            Job.objects.create(task='process_image', object_id=1, state=state,
+                               finished_at=long_ago if state != Job.QUEUED else None)
+        recent = Job.objects.create(task='process_image', object_id=2, state=Job.DONE,
+                                    finished_at=timezone.now())
+
+        out = io.StringIO()
+        call_command('purge_jobs', '--dry-run', stdout=out)
+        self.assertIn('Would delete 2 finished jobs.', out.getvalue())
+        self.assertEqual(Job.objects.count(), 4)
+
+        call_command('purge_jobs', stdout=out)
+        self.assertIn('Deleted 2 finished jobs.', out.getvalue())
+        self.assertEqual(sorted(Job.objects.values_list('state', flat=True)), [Job.DONE, Job.QUEUED])
+        self.assertTrue(Job.objects.filter(pk=recent.pk).exists())
+
+
+@override_settings(EMBED_TRANSPORT='submissions.tests.stub_transport')
+class EmbedCacheTest(TestCase):
+    URL = 'https://videos.stub.test/watch/1'
+
+    def setUp(self):
+        super().setUp()
+        from micawber import Provider
+        providers = embeds.get_providers()
+        providers.register(r'https://videos\.stub\.test/\S+', Provider(STUB_OEMBED_ENDPOINT))
+        self.addCleanup(providers.unregister, r'https://videos\.stub\.test/\S+')
+        del stub_requests[:]
+
+    def run_jobs(self):
+        call_command('runjobs', workers=0, once=True, stdout=io.StringIO())
+
+    def test_save_never_fetches(self):
+        sub = Submission.objects.create()
+        link = Link.objects.create(submission=sub, link=self.URL)
+        self.assertIsNone(link.embed)
+        self.assertEqual(stub_requests, [])
+
+        self.run_jobs()
+        self.assertEqual(len(stub_requests), 1)
+        link.refresh_from_db()
+        self.assertIn('stub.test/embed/1', link.embed)
+
+        # A second link to the same URL comes straight from the cache
+        other = Link.objects.create(submission=sub, link=self.URL)
+        self.assertEqual(other.embed, link.embed)
+        self.assertFalse(Job.objects.filter(state=Job.QUEUED).exists())
+        self.assertEqual(len(stub_requests), 1)
+
+    def test_failures_are_cached(self):
+        url = self.URL + '/missing'
+        Link.objects.create(submission=Submission.objects.create(), link=url)
+        self.run_jobs()
+        entry = EmbedCache.objects.get(url=url)
+        self.assertIsNone(entry.data)
+        self.assertLessEqual((entry.expires_at - entry.fetched_at).total_seconds(), 60 * 60)
+
+        Link.objects.create(submission=Submission.objects.create(), link=url)
+        self.assertFalse(Job.objects.filter(state=Job.QUEUED).exists())
+
+    def test_unknown_providers_need_no_lookup(self):
+        link = Link.objects.create(submission=Submission.objects.create(), link='https://example.com/obituary')
+        self.assertIsNone(link.embed)
+        self.assertFalse(Job.objects.exists())
+
+    def test_feed_shows_poster_instead_of_iframe(self):
+        sub = make_submission()
+        Link.objects.create(submission=sub, link=self.URL, description='Eulogy')
+        self.run_jobs()
+        link = Link.objects.get()
+        self.assertEqual((link.provider, link.thumbnail_url), ('stub', 'http://stub.test/thumb/1.jpg'))
+
+        content = self.client.get(reverse('home')).content.decode()
+        self.assertIn("background-image: url('http://stub.test/thumb/1.jpg')", content)
+        self.assertIn('<template><iframe src="http://stub.test/embed/1"></iframe></template>', content)
+
+    def test_backfill_fills_old_rows(self):
+        sub = Submission.objects.create()
+        Link.objects.bulk_create([Link(submission=sub, link=self.URL, embed='<iframe></iframe>')])
+        call_command('backfill_embeds', stdout=io.StringIO())
+        link = Link.objects.get()
+        self.assertEqual(link.provider, 'stub')
+        self.assertEqual(link.thumbnail_url, 'http://stub.test/thumb/1.jpg')
+
+    def test_video_ids(self):
+        youtube = {'provider_name': 'YouTube', 'html': '<iframe></iframe>'}
+        self.assertEqual(embeds.link_fields('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=3', youtube)['video_id'],
+                         'dQw4w9WgXcQ')
+        self.assertEqual(embeds.link_fields('https://youtu.be/dQw4w9WgXcQ', youtube)['video_id'], 'dQw4w9WgXcQ')
+        vimeo = {'provider_name': 'Vimeo', 'html': '<iframe src="https://player.vimeo.com/video/76979871"></iframe>'}
+        fields = embeds.link_fields('https://vimeo.com/channels/staffpicks/76979871', vimeo)
+        self.assertEqual((fields['provider'], fields['video_id']), ('vimeo', '76979871'))
+
+    def test_registry_is_built_once(self):
+        self.assertIs(embeds.get_providers(), embeds.get_providers())
+
+
+class MarkdownCacheTest(TestCase):
+
+    def test_text_is_rendered_on_save(self):
+        sub = make_submission(text='We went *fishing*.')
+        self.assertEqual(sub.text_html.strip(), '<p>We went <em>fishing</em>.</p>')
+        sub.text = 'Every **summer**.'
+        sub.save(update_fields=['text'])
+        sub.refresh_from_db()
+        self.assertIn('<strong>summer</strong>', sub.text_html)
+
+    def test_feed_does_not_parse_markdown(self):
+        make_submission(text='We went *fishing*.')
+        with mock.patch('markdown2.markdown') as markdown:
+            content = self.client.get(reverse('home')).content.decode()
+        markdown.assert_not_called()
+        self.assertIn('<em>fishing</em>', content)
+
+    def test_settings_change_is_picked_up_by_command(self):
+        sub = make_submission(text='A ~~sad~~ happy day')
+        with override_settings(MARKDOWN_EXTRAS={'strike': None}):
+            call_command('render_markdown', stdout=io.StringIO())
+        sub.refresh_from_db()
+        self.assertIn('<s>sad</s>', sub.text_html)
+
+
+class FeedCacheTest(TestCase):
+
+    def get_feed(self):
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_repeat_views_hit_the_page_cache(self):
+        make_submission(images=2, links=1)
+        self.get_feed()
+        with self.assertNumQueries(0):
+            self.get_feed()
+
+    def test_sending_a_submission_shows_up_immediately(self):
+        self.assertNotIn('Uncle Bob', self.get_feed())
+        sub = Submission.objects.create(name='Uncle Bob', text='Hi')
+        self.assertNotIn('Uncle Bob', self.get_feed())
+
+        session = self.client.session
+        session['submission_unlocked'] = True
+        session['submission_id'] = sub.pk
+        session.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('submission-edit', kwargs={'pk': sub.pk}), {
+                'name': 'Uncle Bob', 'text': 'Hi', 'send': 'Submit',
+                'link_set-TOTAL_FORMS': '0', 'link_set-INITIAL_FORMS': '0',
+            })
+        self.assertIn('Uncle Bob', self.get_feed())
+
+    def test_feed_read_before_commit_is_not_cached_as_new(self):
+        sub = Submission.objects.create(name='Uncle Bob', text='Hi')
+        self.get_feed()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                sub.submitted_at = timezone.now()
+                sub.save()
+                # Another request, racing the commit, sees the old version
+                with mock.patch.object(Submission.objects, 'published', Submission.objects.none):
+                    self.assertNotIn('Uncle Bob', self.get_feed())
+        self.assertIn('Uncle Bob', self.get_feed())
+
+    def test_approval_and_edits_invalidate(self):
+        from mysite import context_processors
+        sub = make_submission(name='Cousin Ann')
+        with mock.patch.object(context_processors.site_config, 'REQUIRE_APPROVAL', True, create=True):
+            self.assertNotIn('Cousin Ann', self.get_feed())
+
+            # As SubmissionAdmin.approve_obj does it
+            sub.accepted_at = timezone.now()
+            sub.accepted_by = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+            with self.captureOnCommitCallbacks(execute=True):
+                sub.save()
+            self.assertIn('Cousin Ann', self.get_feed())
+
+            with self.captureOnCommitCallbacks(execute=True):
+                Image.objects.create(submission=sub, file='late-photo.jpg')
+            self.assertIn('late-photo.jpg', self.get_feed())
+
+            with self.captureOnCommitCallbacks(execute=True):
+                sub.delete()
+            self.assertNotIn('Cousin Ann', self.get_feed())
+
+    def test_unchanged_cards_come_from_fragment_cache(self):
+        first = make_submission(text='first story')
+        make_submission(text='second story')
+        self.get_feed()
+        # Change a card behind the cache's back: only a touch() re-renders it
+        Submission.objects.filter(pk=first.pk).update(text_html='<p>rewritten</p>')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_submission(text='third story')
+        self.assertNotIn('rewritten', self.get_feed())
+        with self.captureOnCommitCallbacks(execute=True):
+            Submission.objects.filter(pk=first.pk).touch()
+        self.assertIn('rewritten', self.get_feed())
+
+
+class ConditionalFeedTest(TestCase):
+
+    def test_revalidation_gets_304_without_rendering(self):
+        make_submission(images=1)
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        for cache_control in ('public', 'max-age=0', 's-maxage=60'):
+            self.assertIn(cache_control, response['Cache-Control'])
+
+        with mock.patch('submissions.views.SubmissionListView.get') as view, self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(
+                self.client.get(reverse('home'), HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        view.assert_not_called()
+
+    def test_changes_and_cursor_change_the_etag(self):
+        make_submission()
+        first = self.client.get(reverse('home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            make_submission()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+        url = reverse('feed-more') + '?after=' + encode_cursor(timezone.now(), 0)
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+    def test_deleting_changes_the_etag(self):
+        sub = make_submission()
+        make_submission()
+        etag = self.client.get(reverse('home'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            sub.delete()
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class KeysetPaginationTest(TestCase):
+
+    def test_pages_cover_feed_once_even_with_equal_timestamps(self):
+        moment = timezone.now()
+        subs = [make_submission(submitted_at=moment) for i in range(12)]
+        subs += [make_submission(submitted_at=moment - timezone.timedelta(minutes=i)) for i in range(1, 14)]
+        seen, url = [], reverse('home')
+        while url:
+            response = self.client.get(url)
+            seen += [sub.pk for sub in response.context['object_list']]
+            next_page = response.context.get('next_page_url')
+            url = reverse('home') + next_page if next_page else None
+        expected = sorted(subs, key=lambda sub: (sub.submitted_at, sub.pk), reverse=True)
+        self.assertEqual(seen, [sub.pk for sub in expected])
+
+    def test_fragment_endpoint(self):
+        for i in range(15):
+            make_submission(text='story %d' % i)
+        first = self.client.get(reverse('home'))
+        self.assertNotIn('story 4', first.content.decode())
+        data = self.client.get(first.context['next_fragment_url']).json()
+        self.assertIn('story 4', data['html'])
+        self.assertIn('class="text-center divider"', data['html'])
+        self.assertNotIn('<html', data['html'])
+        self.assertIsNone(data['next'])
+
+    def test_garbage_cursor_is_404(self):
+        self.assertEqual(self.client.get(reverse('home') + '?after=nope').status_code, 404)
+
+    def test_follows_approval_order_when_required(self):
+        from mysite import context_processors
+        early = make_submission(accepted_at=timezone.now())
+        late = make_submission(accepted_at=timezone.now() - timezone.timedelta(days=1))
+        make_submission()  # not approved
+        with mock.patch.object(context_processors.site_config, 'REQUIRE_APPROVAL', True, create=True):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(list(response.context['object_list']), [early, late])
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite-specific')
+class QueryPlanTest(TestCase):
+    """The hot queries must be served by indexes: no table scans, no sorting."""
+    # Partial indexes only hold matching rows, so scanning one is fine
+    PARTIAL_INDEXES = ('submission_approved_idx',)
+
+    def setUp(self):
+        super().setUp()
+        for i in range(12):
+            make_submission(images=2, links=1)
+
+    def explain(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, sql, params=()):
+        for detail in self.explain(sql, params):
+            self.assertNotIn('TEMP B-TREE', detail, sql)
+            if detail.startswith('SCAN'):
+                self.assertRegex(detail, r'USING (COVERING )?INDEX (%s)\b' % '|'.join(self.PARTIAL_INDEXES), sql)
+
+    def assertQuerysetIndexed(self, queryset):
+        self.assertIndexed(*queryset.query.sql_with_params())
+
+    def assertViewIndexed(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        feed_queries = [q['sql'] for q in queries if 'submissions_' in q['sql']]
+        self.assertTrue(feed_queries)
+        for sql in feed_queries:
+            self.assertIndexed(sql)
+        return response
+
+    def test_feed(self):
+        response = self.assertViewIndexed(reverse('home'))
+        self.assertViewIndexed(reverse('home') + response.context['next_page_url'])
+
+    def test_feed_when_approval_required(self):
+        from mysite import context_processors
+        Submission.objects.update(accepted_at=timezone.now())
+        with mock.patch.object(context_processors.site_config, 'REQUIRE_APPROVAL', True, create=True):
+            response = self.assertViewIndexed(reverse('home'))
+            self.assertViewIndexed(reverse('home') + response.context['next_page_url'])
+
+    def test_moderation_filter(self):
+        from django.contrib.admin.sites import site
+        from .admin import ModerationFilter
+
+        request = RequestFactory().get('/')
+        model_admin = site._registry[Submission]
+        for value, label in ModerationFilter.lookups(None, request, model_admin):
+            moderation = ModerationFilter(request, {'accepted': value}, Submission, model_admin)
+            self.assertQuerysetIndexed(moderation.queryset(request, Submission.objects.order_by('-pk')))
+
+    def test_image_ordering(self):
+        sub = Submission.objects.first()
+        self.assertQuerysetIndexed(sub.image_set.all().order_by('order', 'id'))
+        self.assertQuerysetIndexed(Image.objects.filter(submission=sub).values('pk')[:1])
+
+    def test_job_claim(self):
+        self.assertQuerysetIndexed(Job.objects.filter(state=Job.QUEUED, run_after__lte=timezone.now())
+                                   .order_by('run_after', 'id').values('pk')[:5])
+
+
+class SQLiteProfileTest(TestCase):
+
+    def test_pragmas_applied_on_connect(self):
+        from django.db import connections
+        with override_settings(SQLITE_PRODUCTION=True, SQLITE_BUSY_TIMEOUT=1234):
+            conn = connections.create_connection('default')
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 1234)
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            finally:
+                conn.close()
+
+    def test_parallel_writers(self):
+        """ORM writers on separate connections queue on the lock instead of failing."""
+        from django.db import connections
+        from django.db.models import F
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        alias = 'stress'
+        database = dict(connections.databases['default'], NAME=os.path.join(tmpdir, 'stress.db'),
+                        # timeout=0 so only the profile's busy_timeout makes writers wait
+                        OPTIONS={'timeout': 0}, TEST={})
+        connections.databases[alias] = database
+        self.addCleanup(connections.databases.pop, alias)
+
+        with override_settings(SQLITE_PRODUCTION=True, SQLITE_BUSY_TIMEOUT=30000):
+            with connections[alias].schema_editor() as editor:
+                editor.create_model(Job)
+                editor.create_model(ImageBlob)
+            with connections[alias].cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+            blob = ImageBlob.objects.using(alias).create(sha256='0' * 64, file='x.jpg', size=1)
+            connections[alias].close()
+
+            workers, writes = 8, 50
+            errors = []
+            start = threading.Barrier(workers)
+
+            def writer(worker):
+                try:
+                    start.wait()
+                    for n in range(writes):
+                        Job.objects.using(alias).create(task='process_image', object_id=worker * writes + n)
+                        # Write first, as the app does, so the transaction takes the lock at once
+                        with transaction.atomic(using=alias):
+                            ImageBlob.objects.using(alias).filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+                            Job.objects.using(alias).count()
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    connections[alias].close()
+
+            threads = [threading.Thread(target=writer, args=(i,)) for i in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(Job.objects.using(alias).count(), workers * writes)
+            self.assertEqual(ImageBlob.objects.using(alias).get().refcount, workers * writes)
+            connections[alias].close()
+
+
+class PurgeDraftsTest(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        long_ago = timezone.now() - timezone.timedelta(days=60)
+        self.abandoned = Submission.objects.create()
+        image = Image.objects.create(submission=self.abandoned, file=make_jpeg())
+        image.build_derivatives()
+        image.save()
+        self.recent = Submission.objects.create()
+        self.sent = make_submission()
+        Submission.objects.filter(pk__in=[self.abandoned.pk, self.sent.pk]).update(updated_at=long_ago)
+
+    def purge(self, *args):
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('purge_drafts', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_reports_without_deleting(self):
+        files = sorted(os.listdir(self.media_root))
+        self.assertIn('Would delete 1 drafts with 1 images (', self.purge('--dry-run'))
+        self.assertEqual(Submission.objects.count(), 3)
+        self.assertEqual(sorted(os.listdir(self.media_root)), files)
+
+    def test_deletes_old_drafts_and_their_files(self):
+        self.assertIn('Deleted 1 drafts with 1 images (', self.purge('--batch-size', '1'))
+        self.assertEqual(set(Submission.objects.values_list('pk', flat=True)),
+                         {self.recent.pk, self.sent.pk})
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(os.listdir(self.media_root), [])
+        self.assertIn('Deleted 0 drafts', self.purge())
+
+    def shared_photo(self, *submissions):
+        photo = make_jpeg(100, 100).read()
+        blob = None
+        for sub in submissions:
+            blob, created = ImageBlob.objects.acquire('f' * 64, SimpleUploadedFile('shared.jpg', photo))
+            Image.objects.create(submission=sub, file=blob.file, blob=blob)
+        Submission.objects.filter(pk__in=[sub.pk for sub in submissions]).update(
+            updated_at=timezone.now() - timezone.timedelta(days=60))
+        return '(%d bytes)' % len(photo)
+
+    def test_counts_shared_files_only_when_the_last_user_goes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.abandoned.delete()
+        first, second = Submission.objects.create(), Submission.objects.create()
+        size = self.shared_photo(first, second)
+        self.assertIn('Would delete 2 drafts with 2 images %s' % size, self.purge('--dry-run', '--batch-size', '1'))
+        self.assertIn('Deleted 2 drafts with 2 images %s' % size, self.purge('--batch-size', '1'))
+        self.assertFalse(ImageBlob.objects.exists())
+
+        draft = Submission.objects.create()
+        self.shared_photo(draft, self.sent)
+        self.assertIn('Deleted 1 drafts with 1 images (0 bytes)', self.purge())
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+
+
+class ImageIngestionTest(MediaRootMixin, TestCase):
+
+    def upload(self, upload):
+        sub = Submission.objects.create()
+        self.unlock(sub)
+        return self.client.post(reverse('jfu-upload', kwargs={'pk': sub.pk}), {'file': upload})
+
+    def test_rejects_oversized_image_from_header(self):
+        buf = io.BytesIO()
+        PILImage.new('RGB', (40, 30)).save(buf, format='PNG')
+        with mock.patch('submissions.imaging.MAX_PIXELS', 1000):
+            response = self.upload(SimpleUploadedFile('pano.png', buf.getvalue()))
+        self.assertEqual(response.status_code, 500)
+        self.assertIn(b'too large (40x30)', response.content)
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(os.listdir(self.media_root), [])
+
+    def test_rejects_unsupported_format(self):
+        buf = io.BytesIO()
+        PILImage.new('RGB', (40, 30)).save(buf, format='PPM')
+        response = self.upload(SimpleUploadedFile('photo.jpg', buf.getvalue()))
+        self.assertEqual(response.status_code, 500)
+        self.assertIn(b'Unsupported image format: PPM', response.content)
+
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        from submissions import imaging
+
+        decoded = []
+        exif_transpose = imaging.exif_transpose
+
+        def record(img):
+            decoded.append(img.size)
+            return exif_transpose(img)
+
+        image = Image.objects.create(submission=Submission.objects.create(), file=make_jpeg(4800, 3200))
+        with mock.patch.object(imaging, 'exif_transpose', record):
+            imaging.compress_image(image.file.path)
+        self.assertEqual(decoded, [(2400, 1600)])
+        with PILImage.open(image.file.path) as img:
+            self.assertEqual(img.size, (2000, 1333))
+
+
+class ChunkedUploadTest(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir, ignore_errors=True)
+        override = override_settings(CHUNKED_UPLOAD_DIR=self.upload_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.sub = Submission.objects.create()
+        self.unlock(self.sub)
+        self.data = make_jpeg().read()
+
+    def start(self, size=None):
+        response = self.client.post(reverse('upload-start', kwargs={'pk': self.sub.pk}),
+                                    {'name': 'photo.jpg', 'size': size or len(self.data)})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['url']
+
+    def send(self, url, offset, length):
+        return self.client.post('%s?offset=%d' % (url, offset), self.data[offset:offset + length],
+                                content_type='application/octet-stream')
+
+    def test_upload_in_chunks_with_retry(self):
+        url = self.start()
+        third = len(self.data) // 3
+        self.assertEqual(self.send(url, 0, third).json(), {'offset': third})
+        # A retried chunk that already arrived is not written twice
+        self.assertEqual(self.send(url, 0, third).json(), {'offset': third})
+        # A chunk past what has arrived is refused with the real offset
+        response = self.send(url, 2 * third, third)
+        self.assertEqual((response.status_code, response.json()), (409, {'offset': third}))
+        self.assertEqual(self.client.get(url).json()['offset'], third)
+
+        # While an earlier request still holds the file the client is told to wait
+        import fcntl
+        upload_id = uuid.UUID(url.rstrip('/').rsplit('/', 1)[-1])
+        with open(os.path.join(self.upload_dir, upload_id.hex + '.part'), 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            response = self.send(url, third, third)
+        self.assertEqual(response.status_code, 423)
+        self.assertEqual(response.json()['offset'], third)
+
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 409)
+        self.send(url, third, third)
+        self.send(url, 2 * third, len(self.data))
+
+        response = self.client.post(url + 'complete/')
+        self.assertEqual(response.json()['processing'], Image.PENDING)
+        image = Image.objects.get()
+        self.assertEqual(image.submission, self.sub)
+        with open(image.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertTrue(Job.objects.filter(task='process_image', object_id=image.pk).exists())
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_rejects_other_sessions_and_bad_files(self):
+        url = self.start()
+        other = Submission.objects.create()
+        self.unlock(other)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.unlock(self.sub)
+
+        self.data = b'not an image' * 10
+        url = self.start()
+        self.send(url, 0, len(self.data))
+        response = self.client.post(url + 'complete/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Image.objects.exists())
+
+        response = self.client.post(reverse('upload-start', kwargs={'pk': self.sub.pk}),
+                                    {'name': 'huge.jpg', 'size': 500 * 1024 * 1024})
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_stale_uploads(self):
+        self.start()
+        stale_url = self.start()
+        stale_id = stale_url.rstrip('/').rsplit('/', 1)[-1].replace('-', '')
+        old = time.time() - 2 * 24 * 60 * 60
+        for name in os.listdir(self.upload_dir):
+            if name.startswith(stale_id):
+                os.utime(os.path.join(self.upload_dir, name), (old, old))
+
+        # A chunk still being written keeps it, however old
+        import fcntl
+        with open(os.path.join(self.upload_dir, stale_id + '.part'), 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            out = io.StringIO()
+            call_command('purge_uploads', stdout=out)
+            self.assertIn('Deleted 0 partial uploads', out.getvalue())
+
+        out = io.StringIO()
+        call_command('purge_uploads', stdout=out)
+        self.assertIn('Deleted 1 partial uploads', out.getvalue())
+        self.assertEqual(len(os.listdir(self.upload_dir)), 2)
+        self.assertEqual(self.client.get(stale_url).status_code, 404)
+
+
+class ImageDedupTest(MediaRootMixin, TestCase):
+
+    def upload(self, sub, upload):
+        self.unlock(sub)
+        response = self.client.post(reverse('jfu-upload', kwargs={'pk': sub.pk}), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        return Image.objects.get(pk=response.json()['imageId'])
+
+    def test_duplicate_is_stored_and_processed_once(self):
+        first, second = Submission.objects.create(), Submission.objects.create()
+        photo = make_jpeg().read()
+        a = self.upload(first, SimpleUploadedFile('a.jpg', photo))
+        b = self.upload(second, SimpleUploadedFile('b.jpg', photo))
+        self.assertEqual(a.file.name, b.file.name)
+        self.assertEqual(ImageBlob.objects.get().refcount, 2)
+        self.assertEqual(Job.objects.count(), 1)
+
+        call_command('runjobs', workers=0, once=True, stdout=io.StringIO())
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual((a.status, b.status), (Image.READY, Image.READY))
+        self.assertEqual(a.derivatives, b.derivatives)
+
+        # Uploaded again once processed: ready straight away, no new job
+        c = self.upload(first, SimpleUploadedFile('c.jpg', photo))
+        self.assertEqual((c.status, c.derivatives), (Image.READY, a.derivatives))
+        self.assertEqual((b.width, b.placeholder), (a.width, a.placeholder))
+        self.assertEqual((c.width, c.height, c.color, c.placeholder), (a.width, a.height, a.color, a.placeholder))
+        self.assertEqual(Job.objects.count(), 1)
+        files = sorted(os.listdir(self.media_root))
+        self.assertEqual(len(files), len(a.derivatives))
+
+        # Files stay until the last reference is gone
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('submission-delete', kwargs={'pk': first.pk}))
+        self.assertEqual(sorted(os.listdir(self.media_root)), files)
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+        self.unlock(second)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('jfu-delete', kwargs={'pk': b.pk}))
+        self.assertEqual(os.listdir(self.media_root), [])
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_pending_duplicate_is_processed_when_original_is_deleted(self):
+        first, second = Submission.objects.create(), Submission.objects.create()
+        photo = make_jpeg().read()
+        a = self.upload(first, SimpleUploadedFile('a.jpg', photo))
+        b = self.upload(second, SimpleUploadedFile('b.jpg', photo))
+        a.delete()
+        call_command('runjobs', workers=0, once=True, stdout=io.StringIO())
+        b.refresh_from_db()
+        self.assertEqual(b.status, Image.READY)
+
+
+class ImageOrderTest(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sub = Submission.objects.create()
+        self.unlock(self.sub)
+
+    def reorder(self, ids):
+        return self.client.post(reverse('reorder-images', kwargs={'pk': self.sub.pk}),
+                                json.dumps(ids), content_type='application/json')
+
+    def orders(self):
+        return list(self.sub.image_set.order_by('order', 'id').values_list('pk', flat=True))
+
+    def test_parallel_uploads_get_distinct_positions(self):
+        # Both rows exist before either is positioned, as with two uploads in flight
+        a = Image.objects.create(submission=self.sub, file='a.jpg')
+        b = Image.objects.create(submission=self.sub, file='b.jpg')
+        b.move_to_end()
+        a.move_to_end()
+        self.assertLess(b.order, a.order)
+
+        for name in ('c.jpg', 'd.jpg'):
+            self.client.post(reverse('jfu-upload', kwargs={'pk': self.sub.pk}),
+                             {'file': make_jpeg(name=name)})
+        orders = list(self.sub.image_set.order_by('id').values_list('order', flat=True))
+        self.assertEqual(orders[2:], [a.order + 1, a.order + 2])
+
+    def test_reorder_is_one_update(self):
+        ids = [Image.objects.create(submission=self.sub, file='%d.jpg' % i, order=i).pk for i in range(5)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.reorder(ids[:2][::-1]).status_code, 200)
+        image_updates = [q for q in queries if q['sql'].startswith('UPDATE "submissions_image"')]
+        self.assertEqual(len(image_updates), 1)
+        # Images left out keep their relative order after the listed ones
+        self.assertEqual(self.orders(), [ids[1], ids[0]] + ids[2:])
+
+    def test_reorder_rejects_foreign_and_repeated_ids(self):
+        ids = [Image.objects.create(submission=self.sub, file='%d.jpg' % i, order=i).pk for i in range(3)]
+        other = make_submission(images=1).image_set.get()
+        self.assertEqual(self.reorder([ids[2], other.pk]).status_code, 400)
+        self.assertEqual(self.reorder([ids[2], ids[2]]).status_code, 400)
+        self.assertEqual(self.reorder({'ids': ids}).status_code, 400)
+        self.assertEqual(self.orders(), ids)
+        self.assertEqual(other.order, Image.objects.get(pk=other.pk).order)
+
+
+class AdminModerationTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.changelist = reverse('admin:submissions_submission_changelist')
+
+    def make_queue(self, count):
+        for i in range(count):
+            sub = make_submission(images=2, links=1)
+            sub.image_set.update(derivatives=[
+                {'name': 'thumb-%d.webp' % sub.pk, 'width': 480, 'format': 'webp'},
+                {'name': 'thumb-%d.jpg' % sub.pk, 'width': 480, 'format': 'jpeg'},
+            ])
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.make_queue(3)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.changelist)
+        self.make_queue(20)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.changelist)
+        self.assertEqual(len(small), len(large))
+
+        sub = Submission.objects.last()
+        self.assertContains(response, '<img src="/site_media/media/thumb-%d.jpg"' % sub.pk)
+        self.assertContains(response, '<td class="field-image_count">2</td>')
+        self.assertContains(response, '<td class="field-link_count">1</td>')
+
+    def test_bulk_approve_and_unapprove(self):
+        self.make_queue(3)
+        draft = Submission.objects.create()
+        version = feedcache.feed_version()
+        ids = list(Submission.objects.values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.changelist, {
+                'action': 'approve', admin.helpers.ACTION_CHECKBOX_NAME: ids}, follow=True)
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "submissions_submission"')]
+        self.assertEqual(len(updates), 1)
+        self.assertContains(response, 'Approved 3 submissions.')
+        self.assertEqual(Submission.objects.filter(accepted_by=self.admin).count(), 3)
+        self.assertIsNone(Submission.objects.get(pk=draft.pk).accepted_at)
+        self.assertNotEqual(feedcache.feed_version(), version)
+
+        # The changelist lists the approval queue unless told otherwise
+        response = self.client.post(self.changelist + '?accepted=sent_accepted', {
+            'action': 'unapprove', admin.helpers.ACTION_CHECKBOX_NAME: ids}, follow=True)
+        self.assertContains(response, 'Withdrew approval of 3 submissions.')
+        self.assertFalse(Submission.objects.filter(accepted_at__isnull=False).exists())
+
+    def test_image_inline_leaves_files_and_blobs_alone(self):
+        sub = make_submission(images=8)
+        for image in sub.image_set.all():
+            blob = ImageBlob.objects.create(sha256='%064d' % image.pk, file=image.file.name,
+                                            size=1, refcount=1)
+            Image.objects.filter(pk=image.pk).update(blob=blob)
+        url = reverse('admin:submissions_submission_change', args=[sub.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        blob_queries = [q for q in queries if 'FROM "submissions_imageblob"' in q['sql']]
+        self.assertLessEqual(len(blob_queries), 1)
+        self.assertNotContains(response, 'name="image_set-0-blob"')
+        self.assertNotContains(response, 'name="image_set-0-file"')
+        self.assertNotContains(response, 'name="image_set-0-placeholder"')
+        self.assertContains(response, 'name="image_set-0-order"')
+
+    def test_approve_button(self):
+        sub = make_submission()
+        url = reverse('admin:submissions_submission_actions', kwargs={'pk': sub.pk, 'tool': 'approve_obj'})
+        self.client.post(url)
+        sub.refresh_from_db()
+        self.assertEqual(sub.accepted_by, self.admin)
+
+
+class NotificationOutboxTest(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from mysite import context_processors
+        self.site_config = context_processors.site_config
+        patcher = mock.patch.multiple(self.site_config, create=True,
+                                      NOTIFICATION_EMAIL='family@example.com',
+                                      NOTIFICATION_DIGEST_MINUTES=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sendmail = mock.patch('submissions.notifications.subprocess.run').start()
+        self.sendmail.return_value = mock.Mock(returncode=0, stderr=b'')
+        self.addCleanup(mock.patch.stopall)
+
+    def send(self, name):
+        sub = Submission.objects.create(name=name, text='Hi')
+        self.unlock(sub)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.response = self.client.post(reverse('submission-edit', kwargs={'pk': sub.pk}), {
+                'name': name, 'text': 'Hi', 'send': 'Submit',
+                'link_set-TOTAL_FORMS': '0', 'link_set-INITIAL_FORMS': '0',
+            })
+        return sub
+
+    def run_jobs(self):
+        call_command('runjobs', workers=0, once=True, stdout=io.StringIO())
+
+    def emails(self):
+        return [call.kwargs['input'].decode() for call in self.sendmail.call_args_list]
+
+    def test_submit_queues_instead_of_sending(self):
+        sub = self.send('Uncle Bob')
+        self.sendmail.assert_not_called()
+        self.assertEqual(Notification.objects.get().submission, sub)
+
+        self.run_jobs()
+        [email] = self.emails()
+        self.assertIn('Subject: New submission from Uncle Bob', email)
+        self.assertIn('To: family@example.com', email)
+        self.assertIsNotNone(Notification.objects.get().sent_at)
+
+    def test_failed_delivery_is_retried(self):
+        self.send('Uncle Bob')
+        self.sendmail.return_value = mock.Mock(returncode=75, stderr=b'try again later')
+        with self.assertLogs('submissions', 'ERROR'):
+            self.run_jobs()
+        self.assertIsNone(Notification.objects.get().sent_at)
+        job = Job.objects.get(task='deliver_notifications')
+        self.assertEqual(job.state, Job.QUEUED)
+        self.assertIn('try again later', job.error)
+
+        self.sendmail.return_value = mock.Mock(returncode=0, stderr=b'')
+        Job.objects.update(run_after=timezone.now())
+        self.run_jobs()
+        self.assertEqual(len(self.emails()), 2)
+        self.assertIsNotNone(Notification.objects.get().sent_at)
+
+    def test_digest_groups_a_window_into_one_email(self):
+        self.site_config.NOTIFICATION_DIGEST_MINUTES = 30
+        for name in ('Ann', 'Bob', 'Cy'):
+            self.send(name)
+        self.run_jobs()
+        self.sendmail.assert_not_called()
+
+        Job.objects.update(run_after=timezone.now())
+        self.run_jobs()
+        [email] = self.emails()
+        self.assertIn('Subject: 3 new submissions', email)
+        for name in ('Ann', 'Bob', 'Cy'):
+            self.assertIn('From: %s\n' % name, email)
+        self.assertFalse(Notification.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(set(Job.objects.values_list('state', flat=True)), {Job.DONE})
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_inline_delivery_failure_keeps_the_submission(self):
+        self.sendmail.return_value = mock.Mock(returncode=75, stderr=b'try again later')
+        with self.assertLogs('submissions', 'ERROR'):
+            sub = self.send('Uncle Bob')
+        self.assertEqual(self.response.status_code, 302)
+        self.assertIsNotNone(Submission.objects.get(pk=sub.pk).submitted_at)
+        self.assertIsNone(Notification.objects.get().sent_at)
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_inline_mode_keeps_the_digest_window(self):
+        self.site_config.NOTIFICATION_DIGEST_MINUTES = 30
+        self.send('Uncle Bob')
+        self.sendmail.assert_not_called()
+        self.assertGreater(Job.objects.get(task='deliver_notifications').run_after, timezone.now())
+
+    def test_nothing_queued_without_an_address(self):
+        self.site_config.NOTIFICATION_EMAIL = ''
+        self.send('Uncle Bob')
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(Job.objects.filter(task='deliver_notifications').exists())
+
+
+class MediaServingTest(MediaRootMixin, TestCase):
+    DERIVATIVE = 'a' * 64 + '_480w.jpg'
+
+    def setUp(self):
+        super().setUp()
+        for name in ('photo.jpg', self.DERIVATIVE):
+            with open(os.path.join(self.media_root, name), 'wb') as f:
+                f.write(b'0123456789')
+
+    def get(self, name, **headers):
+        return self.client.get('/site_media/media/' + name, **headers)
+
+    def test_full_response_and_revalidation(self):
+        response = self.get('photo.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        # Rebuilding derivatives rewrites them under the same names
+        self.assertEqual(self.get(self.DERIVATIVE)['Cache-Control'], 'public, max-age=86400')
+
+        response = self.get('photo.jpg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_byte_ranges(self):
+        response = self.get('photo.jpg', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response = self.get('photo.jpg', HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        self.assertEqual(self.get('photo.jpg', HTTP_RANGE='bytes=10-').status_code, 416)
+        # An outdated If-Range gets the whole file
+        response = self.get('photo.jpg', HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_paths_outside_media_root(self):
+        self.assertEqual(self.get('../site_config.py').status_code, 404)
+        self.assertEqual(self.get('missing.jpg').status_code, 404)
+
+    def test_hands_off_to_front_end_server(self):
+        with override_settings(MEDIA_SENDFILE='nginx'):
+            response = self.get('photo.jpg')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/photo.jpg')
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_SENDFILE='sendfile'):
+            response = self.get('photo.jpg')
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, 'photo.jpg'))
+
+
+class StartupTest(BaseTestCase):
+
+    def test_worker_start_skips_heavy_imports(self):
+        from .management.commands.bench_startup import probe_startup
+        result = probe_startup()
+        self.assertNotIn('PIL', result['loaded'])
+        self.assertNotIn('extra_views', result['loaded'])
+        self.assertNotIn('micawber', result['loaded'])
+
+    def test_site_settings_built_once(self):
+        from mysite import context_processors
+        first = context_processors.site_settings(None)
+        self.assertIs(context_processors.site_settings(None), first)
+        with self.assertRaises(TypeError):
+            first['SITE_TITLE'] = 'Changed'
+
+
+class BenchmarkTest(MediaRootMixin, TestCase):
+
+    def test_seed_and_benchmark(self):
+        call_command('seed_memorial', submissions=40, photos=2, drafts=0, stdout=io.StringIO())
+        self.assertEqual(Submission.objects.published().count(), 40)
+        blob = ImageBlob.objects.first()
+        self.assertEqual(blob.refcount, Image.objects.filter(blob=blob).count())
+        self.assertTrue(Image.objects.filter(status=Image.READY).exclude(derivatives=[]).exists())
+
+        out = io.StringIO()
+        call_command('benchmark', iterations=2, warmup=0, depth=2, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['scenarios']), {
+            'home', 'home-cached', 'deep-page', 'feed-more', 'edit-form', 'upload', 'reorder',
+            'admin-changelist'})
+        for name, result in report['scenarios'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(report['scenarios']['home']['queries']['median'], 4)
+        # Nothing the benchmark did is kept
+        self.assertEqual(Submission.objects.count(), 40)
+        self.assertFalse(User.objects.exists())
+
+
+class RequestTimingTest(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from mysite import metrics
+        self.metrics = metrics
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_server_timing_header(self):
+        make_submission(images=1)
+        timing = self.client.get('/')['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="4 queries"')
+        self.assertIn('template;dur=', timing)
+
+    def test_spans_from_inline_jobs(self):
+        sub = Submission.objects.create()
+        self.unlock(sub)
+        with override_settings(JOBS_RUN_INLINE=True):
+            response = self.client.post(reverse('jfu-upload', kwargs={'pk': sub.pk}), {'file': make_jpeg()})
+        self.assertIn('compress;dur=', response['Server-Timing'])
+
+    def test_slow_requests_logged_with_worst_sql(self):
+        make_submission()
+        with override_settings(SLOW_REQUEST_MS=0), self.assertLogs('mysite.timing', 'WARNING') as logs:
+            self.client.get('/')
+        self.assertIn('Slow request: GET / took', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+        metrics_dir = os.path.join(self.media_root, 'metrics')
+        with override_settings(METRICS_TOKEN='secret', METRICS_DIR=metrics_dir):
+            self.client.get('/')
+            self.client.get('/')
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+            # Another worker's numbers are added in
+            with open(os.path.join(metrics_dir, 'worker-1-1.json'), 'w') as f:
+                json.dump({'home': dict(self.metrics.empty_view_metrics(), buckets=[1] + [0] * 11)}, f)
+            response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('memorial_request_duration_seconds_count{view="home"} 3\n', body)
+        self.assertIn('memorial_request_duration_seconds_bucket{view="home",le="0.005"} ', body)
+        self.assertIn('memorial_responses_total{view="home",status="2xx"} 2\n', body)
+        self.assertIn('memorial_db_queries_total{view="home"} ', body)
+        self.assertIn('memorial_span_seconds_total{view="home",span="template"} ', body)
+
+
+class SearchTest(TestCase):
+
+    def search(self, q, **params):
+        return self.client.get(reverse('search'), dict(params, q=q))
+
+    def test_ranked_and_highlighted(self):
+        make_submission(name='Tom', text='We went to the lake, and Tom caught a fish.')
+        fishing = make_submission(name='May', text='The fishing trip in 1998 <b>never</b> ended.')
+        make_submission(name='Rosa', text='She loved her garden.')
+        page = SearchPage('fishing trip')
+        self.assertEqual([r.submission for r in page.results], [fishing])
+        self.assertIn('<mark>fishing</mark> <mark>trip</mark>', page.results[0].snippet)
+        # Stories are escaped; only the highlight markup is HTML
+        self.assertIn('&lt;b&gt;never&lt;/b&gt;', page.results[0].snippet)
+
+        # Stemming and prefix matching: "fish" finds both
+        self.assertEqual(len(SearchPage('fish').results), 2)
+        response = self.search('fis')
+        self.assertContains(response, '<mark>fishing</mark>')
+        # Operators typed into the box are just words
+        self.assertEqual(self.search('fish" OR NOT (').status_code, 200)
+
+    def test_index_follows_saves_and_deletes(self):
+        sub = make_submission(name='Tom', text='Road trip to the coast.')
+        self.assertEqual(len(SearchPage('coast').results), 1)
+        sub.text = 'Weekends at the cabin.'
+        sub.save()
+        self.assertEqual(len(SearchPage('coast').results), 0)
+        self.assertEqual(len(SearchPage('cabin').results), 1)
+
+        link = Link.objects.create(submission=sub, link='https://example.com/x', description='Accordion solo')
+        self.assertEqual(SearchPage('accordion').results[0].submission, sub)
+        link.delete()
+        self.assertEqual(len(SearchPage('accordion').results), 0)
+
+        draft = Submission.objects.create(text='A cabin draft')
+        self.assertEqual(len(SearchPage('cabin').results), 1)
+        sub.delete()
+        draft.delete()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM submissions_search')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_visibility_and_paging(self):
+        from mysite import context_processors
+        approved = make_submission(text='Piano lessons', accepted_at=timezone.now())
+        make_submission(text='Piano recital')
+        self.assertEqual(len(SearchPage('piano').results), 2)
+        with mock.patch.object(context_processors.site_config, 'REQUIRE_APPROVAL', True, create=True):
+            self.assertEqual([r.submission for r in SearchPage('piano').results], [approved])
+
+        for i in range(11):
+            make_submission(text='Piano %d' % i)
+        first, second = SearchPage('piano', 1), SearchPage('piano', 2)
+        self.assertTrue(first.has_next)
+        self.assertEqual((len(first.results), len(second.results), second.has_next), (10, 3, False))
+
+    def test_rebuild(self):
+        sub = make_submission(text='Snow days')
+        Submission.objects.filter(pk=sub.pk).update(text='Sunny days')  # bypasses the receivers
+        out = io.StringIO()
+        call_command('rebuild_search', stdout=out)
+        self.assertEqual(out.getvalue(), 'Indexed 1 submissions.\n')
+        self.assertEqual(len(SearchPage('sunny').results), 1)
+        self.assertEqual(len(SearchPage('snow').results), 0)
+
+
+class StaticExportTest(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output, ignore_errors=True)
+
+    def export(self, **options):
+        out = io.StringIO()
+        call_command('export_static', self.output, page_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def read(self, path):
+        with open(os.path.join(self.output, path)) as f:
+            return f.read()
+
+    def test_incremental_export(self):
+        base = timezone.now() - timezone.timedelta(days=1)
+        subs = [make_submission(text='Memory %d' % i, submitted_at=base + timezone.timedelta(minutes=i))
+                for i in range(5)]
+        with open(os.path.join(self.media_root, 'photo.jpg'), 'wb') as f:
+            f.write(b'jpeg')
+        Image.objects.create(submission=subs[0], file='photo.jpg')
+
+        # Oldest first: page 1 = 0-1; the front page has 2-4 since 4 is alone
+        self.assertIn('Rendered 2 pages: 2 written', self.export())
+        front = self.read('index.html')
+        self.assertIn('Memory 4', front)
+        self.assertIn('Memory 2', front)
+        self.assertIn('href="/page/1/"', front)
+        self.assertNotIn('action="/search/"', front)
+        self.assertIn('action="/search/"', self.client.get(reverse('home')).content.decode())
+        self.assertIn('Memory 0', self.read('page/1/index.html'))
+        self.assertEqual(self.read('site_media/media/photo.jpg'), 'jpeg')
+
+        self.assertIn('Rendered 0 pages', self.export())
+
+        # Filling the newest page splits the front page; page 1 stays as it was
+        make_submission(text='Memory 5')
+        self.assertIn('Rendered 2 pages: 2 written', self.export())
+        self.assertIn('href="/page/2/"', self.read('index.html'))
+        self.assertIn('Memory 2', self.read('page/2/index.html'))
+        # After that, a new submission changes only the front page
+        make_submission(text='Memory 6')
+        self.assertIn('Rendered 1 pages: 1 written', self.export())
+        self.assertIn('Memory 6', self.read('index.html'))
+
+        # Editing an old one re-renders its page; removing its photo removes the copy
+        subs[0].text = 'Memory zero'
+        subs[0].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            subs[0].image_set.all().delete()
+        self.assertIn('Rendered 1 pages', self.export())
+        self.assertIn('Memory zero', self.read('page/1/index.html'))
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'site_media/media/photo.jpg')))
+
+        # Unpublishing shifts the later pages; pages no longer needed go
+        Submission.objects.exclude(pk=subs[1].pk).delete()
+        self.assertIn('files removed', self.export())
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'page/1/index.html')))
+        self.assertIn('Memory 1', self.read('index.html'))
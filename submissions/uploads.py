@@ -0,0 +1,199 @@
+"""Resumable, chunked photo uploads.
+
+The dropzone starts an upload (``ChunkedUpload.start``), then appends the
+file a chunk at a time. The bytes on disk are the upload's progress: after a
+dropped connection the client asks for the current offset and carries on
+from there. Once every byte has arrived the partial file is handed to the
+usual ``ImageUploadForm`` as if it had been posted in one piece.
+
+Partial uploads live in CHUNKED_UPLOAD_DIR, outside MEDIA_ROOT, as a
+``<id>.part`` file plus a ``<id>.json`` sidecar naming the submission, file
+name and expected size. ``manage.py purge_uploads`` removes abandoned ones.
+"""
+import fcntl
+import json
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+COPY_BUFFER = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadLocked(UploadError):
+    """Another request is writing to the same upload right now."""
+
+
+class AssembledUpload(UploadedFile):
+    """A finished partial file, passed to forms like a Django temporary upload.
+
+    Providing ``temporary_file_path()`` lets ImageField validate it by path
+    and lets FileSystemStorage move it into MEDIA_ROOT instead of copying.
+    """
+
+    def __init__(self, path, name, size):
+        super().__init__(open(path, 'rb'), name, None, size)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class ChunkedUpload:
+
+    def __init__(self, upload_id, submission_id, name, size):
+        self.id = upload_id
+        self.submission_id = submission_id
+        self.name = name
+        self.size = size
+
+    @staticmethod
+    def directory():
+        return settings.CHUNKED_UPLOAD_DIR
+
+    @classmethod
+    def paths(cls, upload_id):
+        base = os.path.join(cls.directory(), upload_id.hex)
+        return base + '.part', base + '.json'
+
+    @property
+    def part_path(self):
+        return self.paths(self.id)[0]
+
+    @classmethod
+    def start(cls, submission_id, name, size):
+        if not 0 < size <= MAX_UPLOAD_SIZE:
+            raise UploadError('Photos can be up to %d MB.' % (MAX_UPLOAD_SIZE // 1024 // 1024))
+        upload = cls(uuid.uuid4(), submission_id, os.path.basename(name)[:100] or 'photo', size)
+        part_path, meta_path = cls.paths(upload.id)
+        os.makedirs(cls.directory(), exist_ok=True)
+        open(part_path, 'xb').close()
+        with open(meta_path, 'x') as f:
+            json.dump({'submission': submission_id, 'name': upload.name, 'size': size}, f)
+        return upload
+
+    @classmethod
+    def get(cls, upload_id, submission_id):
+        """The upload ``upload_id`` if it belongs to ``submission_id``, else None."""
+        try:
+            with open(cls.paths(upload_id)[1]) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta['submission'] != submission_id:
+            return None
+        return cls(upload_id, submission_id, meta['name'], meta['size'])
+
+    @property
+    def offset(self):
+        """Number of bytes received so far."""
+        try:
+            return os.path.getsize(self.part_path)
+        except OSError:
+            return 0
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    def append(self, stream, offset, length):
+        """Write ``length`` bytes from ``stream`` at ``offset``; return the new offset.
+
+        ``offset`` must equal the bytes already received, so a retried chunk
+        can't be written twice. Whatever arrives before a dropped connection
+        is kept, and the client resumes from there.
+        """
+        if length > MAX_CHUNK_SIZE:
+            raise UploadError('Chunk too large.')
+        with open(self.part_path, 'ab') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadLocked('Upload in progress.')
+            received = os.fstat(f.fileno()).st_size
+            if offset != received:
+                return received
+            remaining = min(length, self.size - received)
+            while remaining > 0:
+                data = stream.read(min(COPY_BUFFER, remaining))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+            f.flush()
+            return os.fstat(f.fileno()).st_size
+
+    def as_file(self):
+        return AssembledUpload(self.part_path, self.name, self.size)
+
+    def discard(self):
+        for path in self.paths(self.id):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    @classmethod
+    def purge_stale(cls, max_age, dry_run=False):
+        """Remove partial uploads untouched for ``max_age`` seconds.
+
+        Returns ``(uploads, bytes)`` removed (or that would be, with ``dry_run``).
+        """
+        cutoff = time.time() - max_age
+        uploads = reclaimed = 0
+        try:
+            names = os.listdir(cls.directory())
+        except FileNotFoundError:
+            return 0, 0
+        for name in names:
+            stale = cls.stale(name, cutoff)
+            if stale is None:
+                continue
+            upload_id, received = stale
+            uploads += 1
+            reclaimed += received
+            if not dry_run:
+                cls(upload_id, None, '', 0).discard()
+        return uploads, reclaimed
+
+    @classmethod
+    def stale(cls, name, cutoff):
+        """``(upload id, bytes received)`` if ``name`` is the sidecar of an upload
+        untouched since ``cutoff`` and not being written to, else None."""
+        stem, ext = os.path.splitext(name)
+        if ext != '.json':
+            return None
+        try:
+            upload_id = uuid.UUID(hex=stem)
+        except ValueError:
+            return None
+        upload = cls(upload_id, None, '', 0)
+        part_path, meta_path = cls.paths(upload_id)
+        try:
+            # The part file's mtime moves with every chunk received
+            stat = os.stat(part_path if os.path.exists(part_path) else meta_path)
+        except OSError:
+            return None
+        if stat.st_mtime >= cutoff or upload.locked:
+            return None
+        return upload_id, upload.offset
+
+    @property
+    def locked(self):
+        """Whether a request is appending a chunk right now."""
+        try:
+            with open(self.part_path, 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        return False
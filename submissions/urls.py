@@ -1,17 +1,43 @@
 from django.urls import path, re_path
+from django.utils.module_loading import import_string
 
+from .feedcache import cache_feed_page, conditional_feed_page
 from .views import (
-    submission, submission_password, SubmissionListView,
-    SubmissionUpdateView, ImageCreateView, delete_image, delete_submission,
-    reorder_images
+    submission, submission_password, SubmissionListView, SubmissionFeedMoreView,
+    ImageCreateView, delete_image, delete_submission,
+    reorder_images, image_status, upload_start, upload_chunk, upload_complete, search
 )
+
+
+def lazy_view(dotted_path, **initkwargs):
+    """``as_view()`` of the class at ``dotted_path``, imported on first use.
+
+    Keeps the class's dependencies out of every worker's start-up.
+    """
+    view = None
+
+    def wrapped(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(dotted_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+    return wrapped
+
+
 urlpatterns = [
-    path("", SubmissionListView.as_view(), name='home'),  # TODO: add cache_page(60*15) for production
+    path("", conditional_feed_page(cache_feed_page(SubmissionListView.as_view())), name='home'),
+    path("feed/more/", conditional_feed_page(cache_feed_page(SubmissionFeedMoreView.as_view())),
+         name='feed-more'),
+    path("search/", search, name='search'),
     path("submit/", submission, name='submit'),
     path("submit/password/", submission_password, name='submission-password'),
-    path("edit/<int:pk>/", SubmissionUpdateView.as_view(), name='submission-edit'),
+    path("edit/<int:pk>/", lazy_view('submissions.editing.SubmissionUpdateView'), name='submission-edit'),
     path("edit/<int:pk>/upload_image/", ImageCreateView.as_view(), name='jfu-upload'),
+    path("edit/<int:pk>/upload/", upload_start, name='upload-start'),
+    path("edit/<int:pk>/upload/<uuid:upload_id>/", upload_chunk, name='upload-chunk'),
+    path("edit/<int:pk>/upload/<uuid:upload_id>/complete/", upload_complete, name='upload-complete'),
     path("edit/<int:pk>/delete_image/", delete_image, name='jfu-delete'),
+    path("edit/<int:pk>/image_status/", image_status, name='image-status'),
     path("edit/<int:pk>/delete/", delete_submission, name='submission-delete'),
     path("edit/<int:pk>/reorder_images/", reorder_images, name='reorder-images'),
     path("edit/<int:pk>/links/", delete_image, name='link-inlines'),
@@ -0,0 +1,6 @@
+def human_size(size):
+    """``size`` bytes for people: "512 bytes", "3.4 MB"."""
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return ('%d %s' if unit == 'bytes' else '%.1f %s') % (size, unit)
+        size /= 1024
@@ -1,99 +1,25 @@
+import hashlib
 import json
 import logging
-import os
-import subprocess
 from functools import wraps
 
 from django.conf import settings
 from django.urls import reverse
-from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.views.generic import ListView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from .models import Submission, Image, Link
-from django.forms.models import ModelForm, inlineformset_factory
-from django.forms.utils import ErrorList
+from .models import Submission, Image, ImageBlob
 from django import forms
-from django.utils import timezone
-from django.contrib import messages
-from extra_views import InlineFormSet
-from extra_views.advanced import UpdateWithInlinesView
-from PIL import Image as PILImage
-from PIL.ImageOps import exif_transpose
+from .jobs import enqueue
+from .pagination import FeedPage
+from .search import SearchPage
+from .uploads import ChunkedUpload, UploadError, UploadLocked
 
 logger = logging.getLogger(__name__)
 
 
-MAX_DIMENSION = 2000
-JPEG_QUALITY = 85
-
-
-def compress_image(image_path):
-    """Auto-orient, resize if >2000px on any side, and save as JPEG (or PNG if transparent)."""
-    try:
-        img = PILImage.open(image_path)
-
-        # Auto-orient based on EXIF rotation
-        img = exif_transpose(img)
-
-        # Resize if either dimension exceeds MAX_DIMENSION
-        if img.width > MAX_DIMENSION or img.height > MAX_DIMENSION:
-            img.thumbnail((MAX_DIMENSION, MAX_DIMENSION), PILImage.LANCZOS)
-
-        # Keep PNG for images with transparency, convert everything else to JPEG
-        has_transparency = img.mode in ('RGBA', 'LA') or (
-            img.mode == 'P' and 'transparency' in img.info
-        )
-
-        if has_transparency:
-            img.save(image_path, format='PNG', optimize=True)
-        else:
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
-            img.save(image_path, format='JPEG', quality=JPEG_QUALITY, optimize=True)
-    except Exception:
-        logger.exception("Failed to compress image: %s", image_path)
-
-
-def send_submission_notification(submission):
-    """Send email notification about a new submission via sendmail command."""
-    from mysite.context_processors import get_site_config
-
-    to_email = get_site_config('NOTIFICATION_EMAIL', '')
-    if not to_email:
-        return
-
-    from_email = get_site_config('NOTIFICATION_FROM', to_email)
-    sendmail_cmd = get_site_config('SENDMAIL_COMMAND', '/usr/sbin/sendmail')
-
-    subject = "New submission from %s" % (submission.name or 'Anonymous')
-    admin_url = "https://%s/admin/submissions/submission/%s/change/" % (
-        settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost',
-        submission.pk,
-    )
-
-    body = "New submission received.\n\nFrom: %s\n\nView in admin: %s\n" % (
-        submission.name or 'Anonymous',
-        admin_url,
-    )
-
-    email_message = "From: %s\nTo: %s\nSubject: %s\nContent-Type: text/plain; charset=utf-8\n\n%s" % (
-        from_email, to_email, subject, body,
-    )
-
-    try:
-        proc = subprocess.run(
-            [sendmail_cmd, '-t'],
-            input=email_message.encode('utf-8'),
-            capture_output=True,
-            timeout=30,
-        )
-        if proc.returncode != 0:
-            logger.error("sendmail failed (exit %d): %s", proc.returncode, proc.stderr.decode('utf-8', errors='replace'))
-    except Exception:
-        logger.exception("Failed to send submission notification email")
-
-
 def submission_password_required(view_func):
     """Decorator that requires submission password to access a view."""
     @wraps(view_func)
@@ -126,102 +52,47 @@ def submission_password(request):
 
     return render(request, 'submissions/password.html', {'error': error})
 
-class LinkInline(InlineFormSet):
-    model = Link
-    fields = ['link', 'description']
-    extra = 1
-    can_delete = False  # Hide delete checkboxes - empty links are auto-deleted
-
-    def get_queryset(self):
-        # Delete any links with empty link field when loading
-        qs = super().get_queryset()
-        qs.filter(link='').delete()
-        return qs
-
-class SubmissionForm(ModelForm):
-    class Meta:
-        model = Submission
-        widgets={'message': forms.Textarea(attrs={'rows':2, 'cols':15}),
-                 'text': forms.Textarea(attrs={'rows':4, 'cols':15})}
-        fields = ['text','message','name','email',]
-
-    def save(self, commit=True):
-        x = super(SubmissionForm, self).save(commit=False)
-        if 'send' in self.data:
-            x.submitted_at = timezone.now()
-        if commit:
-            x.save()
-        return x
-
-    def clean_name(self):
-        data = self.cleaned_data
-        if 'send' in self.data:
-            if not data.get('name', None):
-                raise forms.ValidationError('Name needed for submission!')
-        return data.get('name', None)
-
-    def clean_text(self):
-        data = self.cleaned_data
-        if 'send' in self.data:
-            if not data.get('text', None) and not self.instance.current_files:
-                raise forms.ValidationError('Text or Pictures needed for submission!')
-        return data.get('text', None)
-
-
-
 class SubmissionListView(ListView):
-    paginate_by = 10
-
-    def get_queryset(self):
-        from mysite.context_processors import get_site_config
-        if get_site_config('REQUIRE_APPROVAL', False):
-            return Submission.objects.filter(accepted_at__isnull=False).order_by('-accepted_at')
-        else:
-            return Submission.objects.filter(submitted_at__isnull=False).order_by('-submitted_at')
-
-class SubmissionUpdateView(SubmissionPasswordRequiredMixin, UpdateWithInlinesView):
-    model = Submission
-    form_class = SubmissionForm
-    inlines = [LinkInline]
-    success_url = '/'
+    template_name = 'submissions/submission_list.html'
+    page_size = 10
 
     def get_queryset(self):
-        base_qs = super(SubmissionUpdateView, self).get_queryset()
-
-        sid = self.request.session.get('submission_id',None)
-        if not sid:
-            sid = Submission.objects.create().pk
-        self.request.session['submission_id'] = sid
-        return base_qs.filter(pk=sid, accepted_at__isnull=True)
-
-    def forms_valid(self, form, inlines):
-        if 'send' in self.request.POST:
-            self.object = form.save()
-            for formset in inlines:
-                formset.save()
-            # Validate required fields
-            if not self.object.name:
-                error = form._errors.setdefault('name', ErrorList())
-                error.append('Name is required!')
-                return self.forms_invalid(form, inlines)
-            if not self.object.text and not self.object.current_files:
-                error = form._errors.setdefault('text', ErrorList())
-                error.append('Please upload images or add text to submit.')
-                return self.forms_invalid(form, inlines)
-            # Mark as submitted
-            self.object.submitted_at = timezone.now()
-            self.object.save()
-            # Send notification email
-            send_submission_notification(self.object)
-            # Clear session so user can make another submission
-            if 'submission_id' in self.request.session:
-                del self.request.session['submission_id']
-            return HttpResponseRedirect('/')
-
-        response = super(SubmissionUpdateView, self).forms_valid(form, inlines)
-        # Clean up empty links
-        self.object.link_set.filter(link='').delete()
-        return response
+        self.feed_page = FeedPage(
+            Submission.objects.published().for_feed(),
+            Submission.objects.feed_field(),
+            cursor=self.request.GET.get('after'),
+            size=self.page_size,
+        )
+        return self.feed_page.items
+
+    def get_context_data(self, **kwargs):
+        context = super(SubmissionListView, self).get_context_data(**kwargs)
+        context['feed_page'] = self.feed_page
+        if self.feed_page.has_next:
+            context['next_page_url'] = '?after=%s' % self.feed_page.next_cursor
+            context['next_fragment_url'] = '%s?after=%s' % (reverse('feed-more'), self.feed_page.next_cursor)
+        return context
+
+
+class SubmissionFeedMoreView(SubmissionListView):
+    """The next batch of feed cards as an HTML fragment, for infinite scroll."""
+    template_name = 'submissions/_submission_items.html'
+
+    def render_to_response(self, context, **response_kwargs):
+        return JsonResponse({
+            'html': render_to_string(self.template_name, context, request=self.request),
+            'next': self.feed_page.next_cursor,
+        })
+
+def search(request):
+    """Ranked, highlighted search over the visible submissions."""
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    results = SearchPage(query, page) if query else None
+    return render(request, 'submissions/search.html', {'query': query, 'search_page': results})
 
 
 @submission_password_required
@@ -235,22 +106,138 @@ def submission(request):
         request.session['submission_id'] = existing.pk
     return HttpResponseRedirect(existing.get_absolute_url())
 
+class ImageUploadForm(forms.ModelForm):
+    class Meta:
+        model = Image
+        fields = ['file']
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        # Pillow is only loaded by the views that take uploads
+        from .imaging import check_upload
+        # ImageField has already read the header into upload.image; nothing is decoded yet
+        check_upload(upload.image)
+        digest = hashlib.sha256()
+        for chunk in upload.chunks():
+            digest.update(chunk)
+        self.sha256 = digest.hexdigest()
+        return upload
+
+
+def save_image_upload(submission, form):
+    """Create the Image for a valid ImageUploadForm and queue its processing.
+
+    A photo already uploaded elsewhere reuses the stored file and whatever
+    processing it has had (or will get) instead of being written again.
+    """
+    image = form.instance
+    image.submission = submission
+    blob, created = ImageBlob.objects.acquire(form.sha256, form.cleaned_data['file'])
+    image.blob = blob
+    image.file = blob.file
+    image.status = Image.PENDING
+    if not created:
+        processed = Image.objects.filter(blob=blob).values('status', *Image.PROCESSED_FIELDS).first()
+        if processed:
+            # If that's still pending or processing, its job updates this row too
+            for field, value in processed.items():
+                setattr(image, field, value)
+        else:
+            created = True
+    image.save()
+    image.move_to_end()
+    if created:
+        # Compression and derivatives happen in `manage.py runjobs`
+        enqueue('process_image', image.pk)
+        image.refresh_from_db(fields=['status'])
+    return image
+
+
+def image_upload_response(image):
+    return JsonResponse({'status': 'success', 'removeLink': reverse('jfu-delete', kwargs={'pk': image.pk}),
+                         'imageId': image.pk, 'processing': image.status})
+
+
 class ImageCreateView(SubmissionPasswordRequiredMixin, CreateView):
     model = Image
-    fields = ['file']
+    form_class = ImageUploadForm
 
     def form_valid(self, form):
         sub = Submission.objects.get(pk=self.kwargs['pk'], submitted_at__isnull=True)
-        form.instance.submission = sub
-        form.instance.order = sub.image_set.count()
-        self.object = form.save()
-        compress_image(self.object.file.path)
-        data = {'status': 'success', 'removeLink': reverse('jfu-delete', kwargs={'pk': self.object.pk}), 'imageId': self.object.pk}
-        response = JsonResponse(data)
-        return response
+        self.object = save_image_upload(sub, form)
+        return image_upload_response(self.object)
 
     def form_invalid(self, form):
-        return HttpResponse('Not an Image', status=500)
+        return HttpResponse(' '.join(form.errors.get('file', ['Not an Image'])), status=500)
+
+@submission_password_required
+def upload_start(request, pk):
+    """Begin a chunked upload; the dropzone then posts the file to the returned URL."""
+    if request.method != 'POST':
+        return HttpResponse('Method not allowed', status=405)
+    if request.session.get('submission_id') != pk:
+        return HttpResponse('Forbidden', status=403)
+    get_object_or_404(Submission, pk=pk, submitted_at__isnull=True)
+    try:
+        upload = ChunkedUpload.start(pk, request.POST.get('name', ''), int(request.POST.get('size', '')))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid size.'}, status=400)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'url': reverse('upload-chunk', kwargs={'pk': pk, 'upload_id': upload.id}),
+                         'offset': 0})
+
+
+@submission_password_required
+def upload_chunk(request, pk, upload_id):
+    """GET: bytes received so far. POST ?offset=n: append the request body there."""
+    if request.session.get('submission_id') != pk:
+        return HttpResponse('Forbidden', status=403)
+    upload = ChunkedUpload.get(upload_id, pk)
+    if upload is None:
+        raise Http404('No such upload')
+    if request.method != 'POST':
+        return JsonResponse({'offset': upload.offset, 'size': upload.size})
+    try:
+        offset = int(request.GET.get('offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid offset.'}, status=400)
+    try:
+        received = upload.append(request, offset, length)
+    except UploadLocked as e:
+        # Unlike a wrong offset, resending at once won't help: an earlier
+        # request (often one the client gave up on) still holds the file.
+        return JsonResponse({'error': str(e), 'offset': upload.offset}, status=423)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=413)
+    # A mismatched offset means a retry of a chunk that already arrived (or a
+    # gap); either way the client continues from what we actually have.
+    status = 200 if offset + length == received or received == upload.size else 409
+    return JsonResponse({'offset': received}, status=status)
+
+
+@submission_password_required
+def upload_complete(request, pk, upload_id):
+    """Turn a fully received chunked upload into an Image, like ImageCreateView."""
+    if request.method != 'POST':
+        return HttpResponse('Method not allowed', status=405)
+    if request.session.get('submission_id') != pk:
+        return HttpResponse('Forbidden', status=403)
+    upload = ChunkedUpload.get(upload_id, pk)
+    if upload is None:
+        raise Http404('No such upload')
+    if not upload.complete:
+        return JsonResponse({'error': 'Upload incomplete.', 'offset': upload.offset}, status=409)
+    sub = get_object_or_404(Submission, pk=pk, submitted_at__isnull=True)
+    with upload.as_file() as uploaded:
+        form = ImageUploadForm(data={}, files={'file': uploaded})
+        image = save_image_upload(sub, form) if form.is_valid() else None
+    upload.discard()
+    if image is None:
+        return JsonResponse({'error': ' '.join(form.errors.get('file', ['Not an Image']))}, status=400)
+    return image_upload_response(image)
+
 
 @submission_password_required
 def delete_image(request, pk):
@@ -258,7 +245,7 @@ def delete_image(request, pk):
     try:
         instance = Image.objects.get( pk = pk )
         if request.session['submission_id']==instance.submission.pk:
-            os.unlink( instance.file.path )
+            # Files go with the last Image using them (see receivers)
             instance.delete()
         else:
             success = False
@@ -268,18 +255,22 @@ def delete_image(request, pk):
     return HttpResponse(  'ok, gone' )
 
 
+@submission_password_required
+def image_status(request, pk):
+    """Processing state of each image in a submission, polled by the dropzone."""
+    if request.session.get('submission_id') != pk:
+        return HttpResponse('Forbidden', status=403)
+    statuses = Image.objects.filter(submission_id=pk).values_list('pk', 'status')
+    return JsonResponse({'images': {str(image_id): status for image_id, status in statuses}})
+
+
 @submission_password_required
 def delete_submission(request, pk):
     """Delete a submission if it belongs to the current session."""
     try:
         submission = Submission.objects.get(pk=pk)
         if request.session.get('submission_id') == submission.pk:
-            # Delete associated images
-            for image in submission.image_set.all():
-                try:
-                    os.unlink(image.file.path)
-                except:
-                    pass
+            # Deletes its images too, and any files no other Image uses
             submission.delete()
             # Clear session
             del request.session['submission_id']
@@ -299,12 +290,11 @@ def reorder_images(request, pk):
         image_ids = json.loads(request.body)
     except (json.JSONDecodeError, ValueError):
         return HttpResponse('Invalid JSON', status=400)
-    submission = Submission.objects.get(pk=pk)
-    for order, image_id in enumerate(image_ids):
-        submission.image_set.filter(pk=image_id).update(order=order)
+    if not isinstance(image_ids, list) or not all(type(pk) is int for pk in image_ids):
+        return HttpResponse('Expected a list of image ids', status=400)
+    submission = get_object_or_404(Submission, pk=pk)
+    try:
+        submission.reorder_images(image_ids)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
     return JsonResponse({'status': 'ok'})
-
-
-def LinkView(InlineFormSetView):
-    model = Submission
-    inlines = [LinkInline]